@@ -5,4 +5,7 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self):
+        from api.registry import build_registry
+
+        build_registry()
         import api.signals  # NoQA
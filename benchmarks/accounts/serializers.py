@@ -0,0 +1,10 @@
+from django.contrib.auth.models import User
+from rest_framework import serializers
+
+
+class UserSerializer(serializers.ModelSerializer):
+    """Stands in for the serializer of the project's accounts app which the API views import."""
+
+    class Meta:
+        model = User
+        fields = ('id', 'username')
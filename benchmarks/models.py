@@ -0,0 +1,59 @@
+from django.db import models
+
+from api.models import BaseModel
+
+
+class Author(BaseModel):
+    """An author with a few works."""
+
+    AVAILABILITY = 'public'
+    SERIALIZER = 'AuthorSerializer'
+    REQUIRED_FIELDS = ['name']
+
+    name = models.TextField()
+    born = models.IntegerField(null=True)
+
+    def get_fields():
+        return {'id': 'AutoField', 'name': 'TextField', 'born': 'IntegerField'}
+
+
+class Tag(BaseModel):
+    """A tag which many works share."""
+
+    AVAILABILITY = 'public'
+    SERIALIZER = 'TagSerializer'
+    REQUIRED_FIELDS = ['label']
+
+    label = models.CharField(max_length=20)
+
+    def get_fields():
+        return {'id': 'AutoField', 'label': 'CharField'}
+
+
+class Work(BaseModel):
+    """A work with a foreign key, a many-to-many relation and large text and JSON fields."""
+
+    AVAILABILITY = 'public'
+    SERIALIZER = 'WorkSerializer'
+    REQUIRED_FIELDS = ['title']
+    RELATED_KEYS = ['author']
+    PREFETCH_KEYS = ['tags']
+
+    title = models.CharField(max_length=100)
+    year = models.IntegerField(null=True)
+    author = models.ForeignKey(Author, null=True, on_delete=models.SET_NULL)
+    tags = models.ManyToManyField(Tag, blank=True)
+    text = models.TextField(blank=True)
+    data = models.JSONField(null=True, blank=True)
+
+    def get_fields():
+        return {
+            'id': 'AutoField',
+            'title': 'CharField',
+            'year': 'IntegerField',
+            'author': 'ForeignKey',
+            'tags': 'ManyToManyField',
+            'text': 'TextField',
+            'data': 'JSONField',
+            'version_number': 'IntegerField',
+        }
@@ -0,0 +1,441 @@
+"""Benchmarks for the generic API views, the search helpers and the serializers.
+
+Run from the directory which contains the api app, for example:
+
+    python -m api.benchmarks.run --size 100000 --output results.json
+    python -m api.benchmarks.run --size 100000 --compare results.json
+
+The synthetic models in `api.benchmarks.models` are seeded in an SQLite database with the requested number of works
+and each scenario is run for a number of iterations, recording the throughput, the latency percentiles and the number
+of queries run for each request. The database is kept and reused while it holds the requested number of works.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import warnings
+
+SCENARIOS = (
+    'list_shallow',
+    'list_deep',
+    'list_fields',
+    'search',
+    'search_m2m',
+    'show',
+    'detail',
+    'update_put',
+    'update_patch',
+    'create',
+    'get_field_filters',
+    'serialize',
+)
+
+# these are run with a commit for each request and their changes are undone afterwards
+WRITE_SCENARIOS = ('update_put', 'update_patch', 'create')
+
+_WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', 'lambda', 'mu')
+
+
+def _setup_django(database):
+    if database:
+        os.environ['API_BENCHMARK_DATABASE'] = os.path.abspath(database)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.benchmarks.settings')
+    # the update views save naive datetimes which would otherwise print a warning for every request
+    warnings.filterwarnings('ignore', message='DateTimeField .* received a naive datetime', category=RuntimeWarning)
+    import django
+
+    django.setup()
+
+
+def _get_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def seed(size, text_size=2000, batch_size=5000, reseed=False):
+    """Fill the database with `size` works and their authors and tags.
+
+    Nothing is done if the database already holds that many works unless `reseed` is True.
+
+    Args:
+        size (int): The number of works.
+        text_size (int): The length of the text field of each work.
+        batch_size (int): The number of rows inserted at once.
+        reseed (bool): Whether to empty and seed the database even if it already has the right number of works.
+    """
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import transaction
+
+    from api.benchmarks.models import Author, Tag, Work
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    if not User.objects.filter(username='benchmark').exists():
+        User.objects.create_superuser('benchmark', password='benchmark')
+    if not reseed and Work.objects.count() == size:
+        return
+    rng = random.Random(0)
+    started = time.perf_counter()
+    with transaction.atomic():
+        Work.tags.through.objects.all().delete()
+        for model in (Work, Author, Tag):
+            model.objects.all().delete()
+        tags = Tag.objects.bulk_create([Tag(label='tag%d' % index, version_number=1) for index in range(50)])
+        authors = Author.objects.bulk_create(
+            [
+                Author(name='Author %d' % index, born=1800 + index % 200, version_number=1)
+                for index in range(max(size // 100, 1))
+            ],
+            batch_size=batch_size,
+        )
+        # the primary keys are only set by bulk_create() on some databases and Django versions
+        tags = list(Tag.objects.order_by('pk'))
+        authors = list(Author.objects.order_by('pk'))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for start in range(0, size, batch_size):
+            Work.objects.bulk_create(
+                [
+                    Work(
+                        title='%s %d' % (rng.choice(_WORDS).title(), index),
+                        year=1900 + rng.randrange(120) if index % 10 else None,
+                        author=rng.choice(authors),
+                        text=_get_text(rng, text_size),
+                        data={'pages': rng.randrange(1, 500), 'keywords': rng.sample(_WORDS, 4), 'index': index},
+                        created_time=now,
+                        created_by='benchmark',
+                        version_number=1,
+                    )
+                    for index in range(start, min(start + batch_size, size))
+                ]
+            )
+            works = Work.objects.order_by('pk')[start:]
+            Work.tags.through.objects.bulk_create(
+                [
+                    Work.tags.through(work_id=work.pk, tag_id=tag.pk)
+                    for work in works
+                    for tag in rng.sample(tags, rng.randrange(4))
+                ]
+            )
+    print('seeded %d works in %.1fs' % (size, time.perf_counter() - started), file=sys.stderr)
+
+
+class _Context:
+    """The client and the data the scenarios use to make their requests."""
+
+    def __init__(self):
+        from django.test import Client
+
+        from api.benchmarks.models import Author, Tag, Work
+
+        self.client = Client()
+        self.client.force_login(self._get_user())
+        self.rng = random.Random(1)
+        self.work_ids = list(Work.objects.order_by('pk').values_list('pk', flat=True))
+        self.author_ids = list(Author.objects.values_list('pk', flat=True)[:100])
+        self.tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        self.works = list(Work.objects.select_related('author').prefetch_related('tags').order_by('pk')[:100])
+        self.planned_work_ids = []
+
+    def _get_user(self):
+        from django.contrib.auth.models import User
+
+        return User.objects.get(username='benchmark')
+
+    def plan_work_ids(self, count):
+        """Choose the works the next `count` requests will use so they can be saved before they are changed."""
+        self.planned_work_ids = [self.rng.choice(self.work_ids) for index in range(count)]
+        return set(self.planned_work_ids)
+
+    def get_work_id(self):
+        if self.planned_work_ids:
+            return self.planned_work_ids.pop(0)
+        return self.rng.choice(self.work_ids)
+
+    def get_document(self, index):
+        return {
+            'title': 'Updated %d' % index,
+            'year': 2000 + index % 20,
+            'author': self.rng.choice(self.author_ids),
+            'tags': self.rng.sample(self.tag_ids, 2),
+            'text': 'updated text %d' % index,
+            'data': {'pages': index, 'keywords': ['updated']},
+        }
+
+
+def _get(context, url, expected=200):
+    response = context.client.get(url)
+    _check_status(url, response, expected)
+
+
+def _send(context, method, url, data, expected=200):
+    response = getattr(context.client, method)(url, json.dumps(data), content_type='application/json')
+    _check_status(url, response, expected)
+
+
+def _check_status(url, response, expected):
+    if response.status_code != expected:
+        raise RuntimeError('%s returned %d instead of %d' % (url, response.status_code, expected))
+    if getattr(response, 'streaming', False):
+        b''.join(response.streaming_content)
+
+
+def _run_scenario(name, context, index):
+    if name == 'list_shallow':
+        _get(context, '/api/benchmarks/work?limit=100')
+    elif name == 'list_deep':
+        offset = max(len(context.work_ids) - 100 - context.rng.randrange(1000), 0)
+        _get(context, '/api/benchmarks/work?limit=100&offset=%d' % offset)
+    elif name == 'list_fields':
+        _get(context, '/api/benchmarks/work?limit=1000&_fields=id,title,year,author')
+    elif name == 'search':
+        _get(context, '/api/benchmarks/work?limit=100&title=%s*&year=>=%d' % (context.rng.choice(_WORDS).title(), 1950))
+    elif name == 'search_m2m':
+        _get(context, '/api/benchmarks/work?limit=100&tags__label=tag%d' % context.rng.randrange(50))
+    elif name == 'show':
+        _show(context)
+    elif name == 'detail':
+        _get(context, '/api/benchmarks/work/%d' % context.get_work_id())
+    elif name == 'update_put':
+        _send(context, 'put', '/api/benchmarks/work/update/%d' % context.get_work_id(), context.get_document(index))
+    elif name == 'update_patch':
+        url = '/api/benchmarks/work/update/%d' % context.get_work_id()
+        _send(context, 'patch', url, {'title': 'Patched %d' % index})
+    elif name == 'create':
+        _send(context, 'post', '/api/benchmarks/work/create', context.get_document(index), expected=201)
+    elif name == 'get_field_filters':
+        _get_field_filters(context, index)
+    elif name == 'serialize':
+        from api.benchmarks.serializers import WorkSerializer
+
+        WorkSerializer(context.works, many=True).data
+
+
+def _show(context):
+    # _show is only available when the list is used directly by another view
+    from django.test import RequestFactory
+    from rest_framework.request import Request
+
+    from api.views import ItemList
+
+    request = Request(RequestFactory().get('/api/benchmarks/work', {'limit': 100, '_show': context.get_work_id()}))
+    ItemList().get_objects(request, app='benchmarks', model='work')
+
+
+def _get_field_filters(context, index):
+    from django.http import QueryDict
+
+    from api.benchmarks.models import Work
+    from api.search_helpers import get_field_filters
+
+    # the values change each time so that the searches are parsed rather than read from the cache
+    query = QueryDict('title=*%d*&year=>%d&year=!%d&tags__label=tag%d,tag%d' % (index, index, index + 1, index, index))
+    get_field_filters(query, Work, 'filter')
+    get_field_filters(query, Work, 'exclude')
+
+
+def _percentile(ordered, percent):
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def _save_works(work_ids):
+    from api.benchmarks.models import Work
+
+    rows = {row['id']: row for row in Work.objects.filter(pk__in=work_ids).values()}
+    tags = {}
+    for work_id, tag_id in Work.tags.through.objects.filter(work_id__in=work_ids).values_list('work_id', 'tag_id'):
+        tags.setdefault(work_id, []).append(tag_id)
+    last_pk = Work.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return rows, tags, last_pk
+
+
+def _restore_works(saved):
+    from django.db import transaction
+
+    from api.benchmarks.models import Work
+
+    rows, tags, last_pk = saved
+    with transaction.atomic():
+        Work.objects.filter(pk__gt=last_pk or 0).delete()
+        fields = [field.attname for field in Work._meta.concrete_fields if not field.primary_key]
+        Work.objects.bulk_update([Work(**row) for row in rows.values()], fields)
+        Work.tags.through.objects.filter(work_id__in=rows).delete()
+        Work.tags.through.objects.bulk_create(
+            [Work.tags.through(work_id=work_id, tag_id=tag_id) for work_id in rows for tag_id in tags.get(work_id, [])]
+        )
+
+
+def measure(name, context, iterations, warmup):
+    """Run a scenario and return its results.
+
+    The scenarios which only read are run in a transaction which is rolled back. The write scenarios are run without
+    a transaction so that each request commits its changes as it would in a server, and the works they change and
+    create are put back afterwards.
+
+    Args:
+        name (str): The name of the scenario.
+        context (_Context): The client and data used by the scenarios.
+        iterations (int): The number of times the scenario is measured.
+        warmup (int): The number of times the scenario is run before it is measured.
+
+    Returns:
+        dict: The throughput (per second), the mean, p50 and p99 latency (in milliseconds) and the mean and maximum
+        number of queries.
+    """
+    from django.db import transaction
+
+    from api.query_planning import count_queries
+
+    latencies = []
+    queries = []
+
+    def run():
+        for index in range(warmup + iterations):
+            with count_queries() as counter:
+                started = time.perf_counter()
+                _run_scenario(name, context, index)
+                latency = time.perf_counter() - started
+            if index >= warmup:
+                latencies.append(latency)
+                queries.append(counter.count)
+
+    if name in WRITE_SCENARIOS:
+        saved = _save_works(context.plan_work_ids(warmup + iterations))
+        try:
+            run()
+        finally:
+            # the changes are undone so the database can be reused
+            context.planned_work_ids = []
+            _restore_works(saved)
+    else:
+        with transaction.atomic():
+            run()
+            # nothing is kept so the database can be reused
+            transaction.set_rollback(True)
+    ordered = sorted(latencies)
+    return {
+        'iterations': iterations,
+        'throughput': iterations / sum(latencies),
+        'mean_ms': sum(latencies) / iterations * 1000,
+        'p50_ms': _percentile(ordered, 50) * 1000,
+        'p99_ms': _percentile(ordered, 99) * 1000,
+        'queries_per_request': sum(queries) / iterations,
+        'max_queries': max(queries),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the regressions of the results against a baseline.
+
+    A scenario has regressed if its p50 or p99 latency is more than `threshold` (a fraction) slower than the baseline
+    or if it runs more queries per request.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of an earlier run.
+        threshold (float): The fraction by which the latency can increase before it is a regression.
+
+    Returns:
+        list: A message for each regression.
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if result[key] > before[key] * (1 + threshold):
+                regressions.append(
+                    '%s %s %.2fms is %.0f%% slower than %.2fms'
+                    % (name, key[:3], result[key], (result[key] / before[key] - 1) * 100, before[key])
+                )
+        if result['queries_per_request'] > before['queries_per_request']:
+            regressions.append(
+                '%s runs %.1f queries per request instead of %.1f'
+                % (name, result['queries_per_request'], before['queries_per_request'])
+            )
+    return regressions
+
+
+def _print_results(results, baseline=None):
+    print('%-18s %10s %10s %10s %10s %8s' % ('scenario', 'req/s', 'mean ms', 'p50 ms', 'p99 ms', 'queries'))
+    for name, result in results['results'].items():
+        line = '%-18s %10.1f %10.2f %10.2f %10.2f %8.1f' % (
+            name,
+            result['throughput'],
+            result['mean_ms'],
+            result['p50_ms'],
+            result['p99_ms'],
+            result['queries_per_request'],
+        )
+        if baseline is not None and name in baseline['results']:
+            line += '   (p50 %+.0f%%)' % ((result['p50_ms'] / baseline['results'][name]['p50_ms'] - 1) * 100)
+        print(line)
+
+
+def main(argv=None):
+    """Seed the database, run the benchmarks and write or compare the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000, help='the number of works to seed (default 10000)')
+    parser.add_argument('--text-size', type=int, default=2000, help='the length of the text of each work')
+    parser.add_argument('--database', help='the SQLite file to use (default API_BENCHMARK_DATABASE or a temp file)')
+    parser.add_argument('--reseed', action='store_true', help='seed the database even if it has the right size')
+    parser.add_argument('--iterations', type=int, default=100, help='the measured runs of each scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='the unmeasured runs of each scenario')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these scenarios')
+    parser.add_argument('--output', help='the file to write the JSON results to')
+    parser.add_argument('--compare', help='a JSON results file to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2, help='the fraction a latency can increase before it is a regression'
+    )
+    args = parser.parse_args(argv)
+
+    _setup_django(args.database)
+    import django
+
+    seed(args.size, text_size=args.text_size, reseed=args.reseed)
+    context = _Context()
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'size': args.size,
+            'text_size': args.text_size,
+            'iterations': args.iterations,
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        'results': {},
+    }
+    for name in args.scenario or SCENARIOS:
+        results['results'][name] = measure(name, context, args.iterations, args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    _print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if baseline is None:
+        return 0
+    if baseline['environment'].get('size') != args.size:
+        print('the baseline was run with %s works' % baseline['environment'].get('size'), file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION: %s' % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
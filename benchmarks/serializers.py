@@ -0,0 +1,17 @@
+from api import serializers as api_serializers
+from api.benchmarks import models
+
+
+class AuthorSerializer(api_serializers.BaseModelSerializer):
+    class Meta:
+        model = models.Author
+
+
+class TagSerializer(api_serializers.BaseModelSerializer):
+    class Meta:
+        model = models.Tag
+
+
+class WorkSerializer(api_serializers.BaseModelSerializer):
+    class Meta:
+        model = models.Work
@@ -0,0 +1,53 @@
+"""Settings for the project the benchmarks are run in.
+
+The database is an SQLite file given by the `API_BENCHMARK_DATABASE` environment variable so that a seeded database
+can be reused between runs.
+"""
+
+import os
+import sys
+import tempfile
+
+# the API views import the serializer of the project's accounts app so a stand in is provided
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SECRET_KEY = 'benchmarks'
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+USE_TZ = True
+USER_IDENTIFIER_FIELD = None
+ROOT_URLCONF = 'api.benchmarks.urls'
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'rest_framework',
+    'api',
+    'api.benchmarks',
+]
+
+MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('API_BENCHMARK_DATABASE', os.path.join(tempfile.gettempdir(), 'api_benchmarks.sqlite3')),
+    }
+}
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'],
+    'DEFAULT_PARSER_CLASSES': ('rest_framework.parsers.JSONParser',),
+}
+
+# the views are measured rather than the shared response cache
+API_RESPONSE_CACHE_TIMEOUT = 0
@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.db.models import Q
+from django.test import RequestFactory, TestCase
+from rest_framework.request import Request
+
+from api.benchmarks.models import Tag, Work
+from api.search_helpers import get_subquery_filter
+from api.views import ItemList
+
+
+class SubqueryFilterTests(TestCase):
+    """Filters on to-many relations are made with EXISTS subqueries only when that gives the same results."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create works with and without tags."""
+        cls.tag = Tag.objects.create(label='red', version_number=1)
+        cls.other_tag = Tag.objects.create(label='blue', version_number=1)
+        cls.tagged = Work.objects.create(title='Tagged', year=1900, version_number=1)
+        cls.tagged.tags.add(cls.tag)
+        cls.untagged = Work.objects.create(title='Untagged', year=2000, version_number=1)
+        cls.other = Work.objects.create(title='Other', year=2000, version_number=1)
+        cls.other.tags.add(cls.other_tag)
+
+    def _filter(self, query):
+        new_query, needs_distinct = get_subquery_filter(Work, query)
+        queryset = Work.objects.filter(new_query)
+        if needs_distinct:
+            queryset = queryset.distinct()
+        return new_query, needs_distinct, set(queryset)
+
+    def test_lookups_on_one_relation_use_a_subquery(self):
+        """Lookups which all follow the same to-many relation are moved into one subquery."""
+        query = Q(tags__label='red', tags__pk=self.tag.pk)
+        new_query, needs_distinct, works = self._filter(query)
+        self.assertFalse(needs_distinct)
+        self.assertNotEqual(new_query, query)
+        self.assertEqual(works, {self.tagged})
+
+    def test_or_with_a_lookup_off_the_relation_keeps_the_join(self):
+        """An OR of a to-many lookup and a lookup on the model itself is left as a join."""
+        query = Q(year=2000) | Q(tags__in=[self.tag.pk])
+        new_query, needs_distinct, works = self._filter(query)
+        self.assertTrue(needs_distinct)
+        self.assertEqual(new_query, Q(query))
+        self.assertEqual(works, {self.tagged, self.untagged, self.other})
+
+    def test_negated_query_with_a_lookup_off_the_relation_keeps_the_join(self):
+        """A negated query mixing a to-many lookup with a lookup on the model itself is left as a join."""
+        query = ~(Q(year=2000) & Q(tags__label='blue'))
+        new_query, needs_distinct, works = self._filter(query)
+        self.assertTrue(needs_distinct)
+        self.assertEqual(new_query, Q(query))
+        self.assertEqual(works, set(Work.objects.exclude(year=2000, tags__label='blue')))
+        self.assertIn(self.untagged, works)
+
+
+class ListPaginationTests(TestCase):
+    """Lists are paginated by offset or by cursor depending on the request."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a few works."""
+        cls.works = [Work.objects.create(title='Work %d' % index, version_number=1) for index in range(5)]
+
+    def test_show_takes_precedence_over_a_cursor(self):
+        """A request with both _show and _cursor is given the page of items containing it by offset."""
+        request = Request(
+            RequestFactory().get('/api/benchmarks/work', {'limit': 2, '_cursor': '', '_show': self.works[3].pk})
+        )
+        data = ItemList().get_objects(request, app='benchmarks', model='work')
+        self.assertEqual(data['offset'], 2)
+        self.assertEqual(list(data['results']), self.works[2:4])
+
+    def test_cursor_cannot_be_used_with_a_to_many_sort(self):
+        """A cursor is rejected for a sorting on a to-many relation as the join would repeat items."""
+        response = self.client.get('/api/benchmarks/work', {'_cursor': '', '_sort': 'tags__label'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('_sort', response.json())
+
+    def test_keyset_model_falls_back_to_offsets_for_a_to_many_sort(self):
+        """A model paginated with cursors by default is paginated by offset when sorted on a to-many relation."""
+        with mock.patch.object(Work, 'PAGINATION', 'keyset', create=True):
+            keyset_response = self.client.get('/api/benchmarks/work', {'_sort': 'title'})
+            offset_response = self.client.get('/api/benchmarks/work', {'_sort': 'tags__label'})
+        self.assertNotIn('count', keyset_response.json())
+        self.assertEqual(offset_response.status_code, 200)
+        self.assertEqual(offset_response.json()['count'], len(self.works))
@@ -0,0 +1,333 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings as django_settings
+from django.core.cache import caches
+
+from api.models import BaseModel
+
+
+def get_cache():
+    """Return the cache used by the API.
+
+    This is the `default` cache unless a different alias is given in the `API_CACHE_ALIAS` setting. Anything cached
+    across requests needs a cache shared by all of the server processes to be invalidated reliably.
+
+    Returns:
+        django.core.cache.backends.base.BaseCache: The cache.
+    """
+    return caches[getattr(django_settings, 'API_CACHE_ALIAS', 'default')]
+
+
+def _get_generation_key(model):
+    return 'api:generation:%s' % model._meta.label_lower
+
+
+def get_model_generations(models):
+    """Return the current generation of each of the models.
+
+    Each model has a generation counter which is increased whenever an instance of the model changes. Including the
+    generation in a cache key means that entries are invalidated by the change without having to find and delete them.
+
+    Args:
+        models (list): The model classes.
+
+    Returns:
+        tuple: The generation of each model in the order given.
+    """
+    cache = get_cache()
+    keys = [_get_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # start from the current time so that a counter which has been evicted cannot return to an old value
+        start = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, start, None)
+        generations.update(cache.get_many(missing))
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+def bump_model_generation(model):
+    """Increase the generation of the model, invalidating anything cached against the previous one.
+
+    Args:
+        model (django.db.models.Model): The model class which has changed.
+    """
+    cache = get_cache()
+    key = _get_generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+
+def get_dependent_models(model):
+    """Return the model and the models it is directly related to.
+
+    Data from the related models can appear in filters and serializations of this model so a change to any of them
+    needs to invalidate cached data about it.
+
+    Args:
+        model (django.db.models.Model): The model class.
+
+    Returns:
+        list: The model followed by its related models.
+    """
+    dependent_models = [model]
+    for field in model._meta.get_fields():
+        if field.is_relation and field.related_model is not None and field.related_model not in dependent_models:
+            dependent_models.append(field.related_model)
+    return dependent_models
+
+
+def get_queryset_key(prefix, queryset):
+    """Return a cache key identifying the rows selected by a queryset.
+
+    The key is built from the SQL of the queryset, so it includes every filter applied, and the generation of the
+    model and its related models.
+
+    Args:
+        prefix (str): The prefix for the key which says what is being cached.
+        queryset (django.db.models.QuerySet): The queryset.
+
+    Returns:
+        str: The cache key.
+    """
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(repr((sql, params)).encode('utf-8')).hexdigest()
+    generations = get_model_generations(get_dependent_models(queryset.model))
+    return 'api:%s:%s:%s:%s' % (prefix, queryset.model._meta.label_lower, '.'.join(map(str, generations)), digest)
+
+
+def get_request_cache(request):
+    """Return a dictionary for caching data for the duration of a single request.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+
+    Returns:
+        dict: The cache for this request.
+    """
+    # the cache is always kept on the django request so that it is shared with the drf request which wraps it
+    request = getattr(request, '_request', request)
+    try:
+        return request._api_cache
+    except AttributeError:
+        request._api_cache = {}
+        return request._api_cache
+
+
+def cache_request_instance(request, instance):
+    """Keep a model instance for the rest of the request so that it does not need to be fetched again.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        instance (django.db.models.Model): The instance.
+    """
+    get_request_cache(request)[('instance', instance._meta.label_lower, str(instance.pk))] = instance
+
+
+def get_cached_request_instance(request, model, pk):
+    """Return the instance of the model with the primary key if it has already been loaded in this request.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        model (django.db.models.Model): The model class.
+        pk (str): The primary key of the instance.
+
+    Returns:
+        django.db.models.Model|None: The instance or None if it has not been loaded.
+    """
+    return get_request_cache(request).get(('instance', model._meta.label_lower, str(pk)))
+
+
+def get_request_instance(request, endpoint, pk):
+    """Return the instance with the primary key from the model of the endpoint, loading it only once per request.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        endpoint (api.registry.Endpoint): The endpoint of the model.
+        pk (str): The primary key of the instance.
+
+    Raises:
+        django.core.exceptions.ObjectDoesNotExist: If there is no such instance.
+
+    Returns:
+        django.db.models.Model: The instance (without any many-to-many data prefetched).
+    """
+    instance = get_cached_request_instance(request, endpoint.model, pk)
+    if instance is None:
+        queryset = endpoint.model.objects.all()
+        if endpoint.related_keys:
+            queryset = queryset.select_related(*endpoint.related_keys)
+        instance = queryset.get(pk=pk)
+        get_request_cache(request)[('instance', endpoint.model._meta.label_lower, str(pk))] = instance
+    return instance
+
+
+def _get_user_groups_key(group_model, user_pk):
+    generation = get_model_generations([group_model])[0]
+    return 'api:groups:%s:%s' % (generation, user_pk)
+
+
+def get_user_group_names(request):
+    """Return the names of the groups the user of the request belongs to.
+
+    The names are looked up once per request. If `API_GROUP_CACHE_TIMEOUT` is set they are also kept in the API cache
+    for that many seconds, which needs a cache shared by all of the server processes as the names decide who is a
+    superuser. The cached names are invalidated when the groups of the user change or any group is changed.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+
+    Returns:
+        frozenset: The names of the groups.
+    """
+    user = request.user
+    if not user.is_authenticated or not hasattr(user, 'groups'):
+        return frozenset()
+    request_cache = get_request_cache(request)
+    try:
+        return request_cache['group_names']
+    except KeyError:
+        pass
+    timeout = getattr(django_settings, 'API_GROUP_CACHE_TIMEOUT', 0)
+    if not timeout:
+        group_names = frozenset(user.groups.values_list('name', flat=True))
+        request_cache['group_names'] = group_names
+        return group_names
+    cache = get_cache()
+    key = _get_user_groups_key(user.groups.model, user.pk)
+    group_names = cache.get(key)
+    if group_names is None:
+        group_names = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, group_names, timeout)
+    request_cache['group_names'] = group_names
+    return group_names
+
+
+def invalidate_user_groups(group_model, user_pks):
+    """Remove the cached group names of the users.
+
+    Args:
+        group_model (django.db.models.Model): The group model.
+        user_pks (iterable): The primary keys of the users whose groups have changed.
+    """
+    get_cache().delete_many([_get_user_groups_key(group_model, user_pk) for user_pk in user_pks])
+
+
+def get_user_project_ids(request, project_model):
+    """Return the ids of the projects the user of the request is a member of.
+
+    A user is a member of a project if they are in any of the fields returned by the `get_user_fields()` function of
+    the project model. The ids are looked up once per request. If `API_PROJECT_CACHE_TIMEOUT` is set and the project
+    model inherits `BaseModel` they are also kept in the API cache for that many seconds. As the key includes the
+    generation of the project model the cached ids are invalidated whenever a project or its membership changes, which
+    needs a cache shared by all of the server processes and the signals which are only sent for `BaseModel` models.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        project_model (django.db.models.Model): The project model.
+
+    Returns:
+        list: The sorted ids of the projects.
+    """
+    request_cache = get_request_cache(request)
+    request_key = ('projects', project_model._meta.label_lower)
+    try:
+        return request_cache[request_key]
+    except KeyError:
+        pass
+    timeout = getattr(django_settings, 'API_PROJECT_CACHE_TIMEOUT', 0)
+    if not timeout or not issubclass(project_model, BaseModel):
+        # without the generation bumps from the signals a change to the membership would not be seen
+        project_ids = _get_user_project_ids(request.user, project_model)
+        request_cache[request_key] = project_ids
+        return project_ids
+    cache = get_cache()
+    generation = get_model_generations([project_model])[0]
+    key = 'api:projects:%s:%s:%s' % (project_model._meta.label_lower, generation, request.user.pk)
+    project_ids = cache.get(key)
+    if project_ids is None:
+        project_ids = _get_user_project_ids(request.user, project_model)
+        cache.set(key, project_ids, timeout)
+    request_cache[request_key] = project_ids
+    return project_ids
+
+
+def _get_user_project_ids(user, project_model):
+    project_ids = set()
+    # a query for each field avoids the duplicate rows and OR of joins of a single query
+    for field in project_model.get_user_fields():
+        project_ids.update(project_model._base_manager.filter((field, user)).values_list('pk', flat=True))
+    return sorted(project_ids)
+
+
+def _increment(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_response_cache_key(request, model, visibility):
+    """Return the key used to cache the response to a request which returns the same data to everyone who makes it.
+
+    The key is built from the visibility class, the model, the generation of the model and its related models and the
+    host, path and query of the request with the query parameters in a normalised order.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        model (django.db.models.Model): The model class of the request.
+        visibility (str): The class of users the response is visible to, such as 'public' or 'anonymous'.
+
+    Returns:
+        str: The cache key.
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = '%s://%s%s?%s' % (request.scheme, request.get_host(), request.path, query)
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
+    generations = get_model_generations(get_dependent_models(model))
+    return 'api:response:%s:%s:%s:%s' % (visibility, model._meta.label_lower, '.'.join(map(str, generations)), digest)
+
+
+def get_cached_response(key):
+    """Return the data and etag of a cached response and record whether it was found.
+
+    Args:
+        key (str): The key from `get_response_cache_key`.
+
+    Returns:
+        tuple|None: The data and etag of the response or None if it is not cached.
+    """
+    cache = get_cache()
+    cached = cache.get(key)
+    _increment(cache, 'api:response-cache:%s' % ('misses' if cached is None else 'hits'))
+    return cached
+
+
+def cache_response(key, data, etag):
+    """Cache the data and etag of a response for `API_RESPONSE_CACHE_TIMEOUT` seconds.
+
+    Args:
+        key (str): The key from `get_response_cache_key`.
+        data (object): The data of the response.
+        etag (str|None): The etag of the response.
+    """
+    get_cache().set(key, (data, etag), getattr(django_settings, 'API_RESPONSE_CACHE_TIMEOUT', 0))
+
+
+def get_response_cache_stats():
+    """Return the number of requests which were and were not found in the response cache.
+
+    Returns:
+        dict: The number of `hits` and `misses`.
+    """
+    counts = get_cache().get_many(['api:response-cache:hits', 'api:response-cache:misses'])
+    return {
+        'hits': counts.get('api:response-cache:hits', 0),
+        'misses': counts.get('api:response-cache:misses', 0),
+    }
@@ -0,0 +1,307 @@
+import hashlib
+import re
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, migrations
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.db.models import BooleanField, CharField, F, Index, TextField
+from django.db.models.functions import Upper
+
+# lookups which compare whole values and so can use a b-tree index on the column
+_BTREE_LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'range', 'isnull')
+
+# lookups which match part of a text value and can only use a trigram index
+_TRIGRAM_LOOKUPS = ('contains', 'endswith', 'regex', 'iregex')
+_UPPER_TRIGRAM_LOOKUPS = ('icontains', 'iendswith')
+
+MIGRATION_HEADER = (
+    '# The indexes in this migration were recommended by the api recommend_indexes command from the filters and\n'
+    '# sorting used in API requests. Review them before applying the migration and add them to the Meta.indexes of\n'
+    '# the models so that makemigrations does not remove them.\n'
+)
+
+
+class Recommendation:
+    """An index recommended for a filter or sorting, or the reason one is not recommended.
+
+    Args:
+        model (django.db.models.Model): The model whose table the index is on.
+        usage (str): The filter (the path and lookup) or sorting which needs the index.
+        count (int): The number of requests which used it.
+        rows (int|None): The number of rows in the table.
+        index (django.db.models.Index|None): The index or None if one is not recommended.
+        reason (str): Why the index is or is not recommended.
+        extension (str|None): The name of a PostgreSQL extension the index needs.
+    """
+
+    def __init__(self, model, usage, count, rows, index, reason, extension=None):
+        self.model = model
+        self.usage = usage
+        self.count = count
+        self.rows = rows
+        self.index = index
+        self.reason = reason
+        self.extension = extension
+
+    def __repr__(self):
+        return '<Recommendation: %s %s %s>' % (self.model._meta.label, self.usage, self.index)
+
+
+def get_table_rows(model, using):
+    """Return the number of rows in the table of the model, estimated on PostgreSQL.
+
+    Args:
+        model (django.db.models.Model): The model.
+        using (str): The database alias.
+
+    Returns:
+        int: The number of rows.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row is not None and row[0] >= 0:
+            return row[0]
+    return model._base_manager.using(using).count()
+
+
+def _get_index_name(model, usage, suffix):
+    # index names can only be 30 characters long and the digest keeps them unique
+    digest = hashlib.md5(('%s.%s.%s' % (model._meta.label_lower, usage, suffix)).encode('utf-8')).hexdigest()[:6]
+    label = re.sub('[^a-z0-9]+', '_', usage.lower()).strip('_')
+    return '%s_%s_%s_%s' % (model._meta.db_table[:9], label[:7], digest, suffix)
+
+
+def _resolve_path(model, path):
+    """Return the model and field a path ends on or None if it does not end on a column."""
+    field = None
+    current = model
+    for part in path.split('__'):
+        if field is not None:
+            if not field.is_relation or field.related_model is None:
+                return None
+            current = field.related_model
+        try:
+            field = current._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+    return current, field
+
+
+def _get_leading_fields(model):
+    """Return the lists of fields which lead existing indexes of the model."""
+    leading = []
+    for field in model._meta.local_concrete_fields:
+        if field.primary_key or field.unique or field.db_index:
+            leading.append([field.name])
+    for index in model._meta.indexes:
+        if index.fields and not index.opclasses and not index.condition:
+            leading.append([field.lstrip('-') for field in index.fields])
+    for fields in list(model._meta.unique_together) + list(getattr(model._meta, 'index_together', [])):
+        leading.append(list(fields))
+    for constraint in model._meta.constraints:
+        if getattr(constraint, 'fields', None) and not getattr(constraint, 'condition', None):
+            leading.append(list(constraint.fields))
+    return leading
+
+
+def _has_index(model, index):
+    """Return True if the model already has the index or an index which can be used in the same way."""
+    if index.fields and not index.opclasses and type(index) is Index:
+        fields = [field.lstrip('-') for field in index.fields]
+        for leading in _get_leading_fields(model):
+            if leading[: len(fields)] == fields:
+                return True
+    path, args, kwargs = index.deconstruct()
+    kwargs.pop('name')
+    for existing in model._meta.indexes:
+        existing_path, existing_args, existing_kwargs = existing.deconstruct()
+        existing_kwargs.pop('name')
+        if (existing_path, existing_args, existing_kwargs) == (path, args, kwargs):
+            return True
+    return False
+
+
+def _get_filter_index(model, field, lookup, vendor):
+    """Return the index which would help a lookup on a field, the extension it needs and the reason for it."""
+    name = field.name
+    if field.many_to_many or field.one_to_many or (field.is_relation and not field.concrete):
+        return None, None, 'the relation is joined on the indexed foreign keys'
+    if isinstance(field, BooleanField):
+        return None, None, 'an index on a boolean is rarely selective enough to be used'
+    text = isinstance(field, (CharField, TextField))
+    if lookup in _BTREE_LOOKUPS:
+        return Index(fields=[name], name=_get_index_name(model, name, 'idx')), None, 'a b-tree index on the column'
+    if not text:
+        if vendor == 'postgresql' and lookup == 'contains' and field.get_internal_type() in ('ArrayField', 'JSONField'):
+            from django.contrib.postgres.indexes import GinIndex
+
+            return GinIndex(fields=[name], name=_get_index_name(model, name, 'gin')), None, 'a GIN index on the column'
+        return None, None, 'no index is recommended for %s on a %s' % (lookup, field.get_internal_type())
+    if vendor == 'mysql' and lookup in ('startswith', 'iexact', 'istartswith'):
+        # the usual collations are case insensitive so the column index can be used
+        return Index(fields=[name], name=_get_index_name(model, name, 'idx')), None, 'a b-tree index on the column'
+    if vendor != 'postgresql':
+        return None, None, 'no index can be used for %s on %s' % (lookup, vendor)
+
+    from django.contrib.postgres.indexes import GinIndex
+
+    try:
+        from django.contrib.postgres.indexes import OpClass
+    except ImportError:
+        # functional indexes and operator classes on expressions need Django 3.2
+        OpClass = None
+
+    # the postgresql backend compares UPPER() of the column for the case insensitive lookups
+    pattern_ops = 'varchar_pattern_ops' if isinstance(field, CharField) else 'text_pattern_ops'
+    if lookup == 'startswith':
+        index = Index(fields=[name], opclasses=[pattern_ops], name=_get_index_name(model, name, 'like'))
+        return index, None, 'a b-tree index with %s so LIKE can use it' % pattern_ops
+    if lookup in ('iexact', 'istartswith'):
+        if OpClass is None:
+            return None, None, 'a functional index on UPPER() needs Django 3.2'
+        # the pattern operator class also supports equality so the one index is used for both lookups
+        index = Index(OpClass(Upper(name), name='text_pattern_ops'), name=_get_index_name(model, name, 'upr'))
+        return index, None, 'a functional index on UPPER() with text_pattern_ops'
+    if lookup in _TRIGRAM_LOOKUPS:
+        index = GinIndex(fields=[name], opclasses=['gin_trgm_ops'], name=_get_index_name(model, name, 'trgm'))
+        return index, 'pg_trgm', 'a trigram GIN index'
+    if lookup in _UPPER_TRIGRAM_LOOKUPS:
+        if OpClass is None:
+            return None, None, 'a trigram GIN index on UPPER() needs Django 3.2'
+        index = GinIndex(OpClass(Upper(name), name='gin_trgm_ops'), name=_get_index_name(model, name, 'utrgm'))
+        return index, 'pg_trgm', 'a trigram GIN index on UPPER()'
+    return None, None, 'no index is recommended for %s' % lookup
+
+
+def _get_sort_index(model, keys, vendor):
+    """Return the index which would help a sorting, or None, and the reason for it."""
+    fields = []
+    for key in keys.split(','):
+        descending = key.startswith('-')
+        try:
+            field = model._meta.get_field(key.lstrip('-'))
+        except FieldDoesNotExist:
+            return None, 'the sorting uses a related model'
+        fields.append((field, descending))
+    if fields[0][0].primary_key:
+        return None, 'the table is already sorted by its primary key'
+    name = _get_index_name(model, keys, 'sort')
+    if vendor == 'postgresql' and any(descending and field.null for field, descending in fields):
+        # the api puts nulls last in both directions but a descending index puts them first by default
+        expressions = [
+            F(field.name).desc(nulls_last=True) if descending else F(field.name).asc() for field, descending in fields
+        ]
+        return Index(*expressions, name=name), 'a b-tree index in the order of the sorting with nulls last'
+    index = Index(fields=['-%s' % field.name if descending else field.name for field, descending in fields], name=name)
+    return index, 'a b-tree index in the order of the sorting'
+
+
+def get_recommendations(stats, using='default', min_count=10, min_rows=10000, vendor=None):
+    """Return the indexes which would help the filters and sorting used in API requests.
+
+    Each filter path is followed to the column it is on and an index is chosen for the lookup. This is a b-tree index
+    for the lookups which compare whole values and on PostgreSQL an index with a pattern operator class for
+    startswith, a functional index on UPPER() for iexact and istartswith (matching the SQL Django uses) and a trigram
+    GIN index for contains and endswith. Each sorting is given a b-tree index in the same order. An index is only
+    recommended if it was used at least `min_count` times, its table has at least `min_rows` rows and the model does
+    not already have an equivalent index.
+
+    Args:
+        stats (dict): The usage counts from `api.usage_stats.get_usage_stats()`.
+        using (str): The alias of the database to recommend indexes for.
+        min_count (int): The number of requests which must have used a filter or sorting.
+        min_rows (int): The number of rows the table must have.
+        vendor (str|None): The database vendor to recommend indexes for, that of the database if None.
+
+    Returns:
+        list: The Recommendation for each filter and sorting, with the most used first. The index is None for those
+        which do not need one.
+    """
+    vendor = vendor or connections[using].vendor
+    recommendations = []
+    rows = {}
+    for label, counts in stats.items():
+        try:
+            model = apps.get_model(label)
+        except LookupError:
+            continue
+        for key, count in counts.items():
+            if key[0] == 'filter':
+                path, lookup = key[1], key[2]
+                usage = '%s__%s' % (path, lookup)
+                resolved = _resolve_path(model, path)
+                if resolved is None:
+                    recommendations.append(
+                        Recommendation(model, usage, count, None, None, 'the filter uses a transform or key')
+                    )
+                    continue
+                target, field = resolved
+                index, extension, reason = _get_filter_index(target, field, lookup, vendor)
+            else:
+                usage = 'sort %s' % key[1]
+                target, extension = model, None
+                index, reason = _get_sort_index(model, key[1], vendor)
+            if index is not None and target not in rows:
+                rows[target] = get_table_rows(target, using)
+            if index is None:
+                pass
+            elif _has_index(target, index):
+                index, reason = None, 'the model already has a suitable index'
+            elif count < min_count:
+                index, reason = None, 'used by fewer than %d requests' % min_count
+            elif rows[target] < min_rows:
+                index, reason = None, 'the table has fewer than %d rows' % min_rows
+            recommendations.append(
+                Recommendation(target, usage, count, rows.get(target), index, reason, extension if index else None)
+            )
+    # a filter used in several ways needs the index once
+    seen = set()
+    for recommendation in sorted(recommendations, key=lambda item: -item.count):
+        if recommendation.index is not None:
+            key = (recommendation.model, recommendation.index.name)
+            if key in seen:
+                recommendation.index, recommendation.reason = None, 'the same index is recommended for another use'
+            seen.add(key)
+    return sorted(recommendations, key=lambda item: (item.index is None, -item.count))
+
+
+def get_migration(app_label, recommendations, name='recommended_indexes'):
+    """Return the path and contents of a migration which adds the recommended indexes of the models in an app.
+
+    Args:
+        app_label (str): The label of the app.
+        recommendations (list): The Recommendations from `get_recommendations()`.
+        name (str): The name of the migration after its number.
+
+    Returns:
+        tuple: The path of the migration file and its contents, or None if no indexes are recommended for the app.
+    """
+    recommendations = [
+        recommendation
+        for recommendation in recommendations
+        if recommendation.index is not None and recommendation.model._meta.app_label == app_label
+    ]
+    if not recommendations:
+        return None
+    operations = []
+    if any(recommendation.extension == 'pg_trgm' for recommendation in recommendations):
+        from django.contrib.postgres.operations import TrigramExtension
+
+        operations.append(TrigramExtension())
+    for recommendation in recommendations:
+        operations.append(
+            migrations.AddIndex(model_name=recommendation.model._meta.model_name, index=recommendation.index)
+        )
+    leaves = MigrationLoader(None, ignore_no_migrations=True).graph.leaf_nodes(app_label)
+    number = (MigrationAutodetector.parse_number(leaves[0][1]) or 0) + 1 if leaves else 1
+    migration = migrations.Migration('%04d_%s' % (number, name), app_label)
+    migration.dependencies = leaves
+    migration.operations = operations
+    writer = MigrationWriter(migration)
+    return writer.path, MIGRATION_HEADER + writer.as_string()
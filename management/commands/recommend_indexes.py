@@ -0,0 +1,82 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from api.index_advisor import get_migration, get_recommendations
+from api.usage_stats import get_usage_stats, reset_usage_stats
+
+
+class Command(BaseCommand):
+    """Recommend database indexes from the filters and sorting used in API requests.
+
+    The usage is counted when `API_USAGE_STATS` is True. Use --migration with an app label to write a migration adding
+    the recommended indexes of that app.
+    """
+
+    help = 'Recommend database indexes from the filters and sorting used in API requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='?', help='Only recommend indexes for the models of this app.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS, help='The database to recommend indexes for (default "default").'
+        )
+        parser.add_argument(
+            '--min-count',
+            type=int,
+            default=10,
+            help='The number of requests which must have used a filter (default 10).',
+        )
+        parser.add_argument(
+            '--min-rows', type=int, default=10000, help='The number of rows a table must have (default 10000).'
+        )
+        parser.add_argument('--migration', action='store_true', help='Write a migration adding the indexes to the app.')
+        parser.add_argument(
+            '--reset', action='store_true', help='Clear the usage counts instead of recommending indexes.'
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_usage_stats()
+            self.stdout.write('The usage counts have been cleared.')
+            return
+        app_label = options['app_label']
+        if options['migration'] and not app_label:
+            raise CommandError('An app label is needed to write a migration.')
+        stats = get_usage_stats()
+        if app_label:
+            stats = {label: counts for label, counts in stats.items() if label.split('.')[0] == app_label}
+        if not stats:
+            self.stdout.write('No API usage has been recorded. Set API_USAGE_STATS to True to record it.')
+            return
+        recommendations = get_recommendations(
+            stats, using=options['database'], min_count=options['min_count'], min_rows=options['min_rows']
+        )
+        if app_label:
+            recommendations = [item for item in recommendations if item.model._meta.app_label == app_label]
+        for recommendation in recommendations:
+            if recommendation.index is None and options['verbosity'] < 2:
+                continue
+            self.stdout.write(
+                '%8d  %s  %s' % (recommendation.count, recommendation.model._meta.label, recommendation.usage)
+            )
+            if recommendation.index is not None:
+                self.stdout.write('          %s (%s rows)' % (recommendation.reason, recommendation.rows))
+                self.stdout.write(self.style.SUCCESS('          %r' % recommendation.index))
+            else:
+                self.stdout.write('          no index: %s' % recommendation.reason)
+        if not any(recommendation.index is not None for recommendation in recommendations):
+            self.stdout.write('No indexes are recommended.')
+            return
+        if options['migration']:
+            migration = get_migration(app_label, recommendations)
+            if migration is None:
+                self.stdout.write('No indexes are recommended for %s.' % app_label)
+                return
+            path, content = migration
+            if os.path.exists(path):
+                raise CommandError('%s already exists.' % path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as migration_file:
+                migration_file.write(content)
+            self.stdout.write(self.style.SUCCESS('Wrote %s for review.' % path))
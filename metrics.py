@@ -0,0 +1,313 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings as django_settings
+from django.db import connections
+
+from api.caching import get_response_cache_stats
+from api.registry import get_endpoint
+from api.slow_requests import get_slow_request_threshold, record_slow_request
+
+# the upper bounds of the histogram buckets for the time taken (in seconds) and the number of queries run
+LATENCY_BUCKETS = tuple(
+    getattr(django_settings, 'API_METRICS_LATENCY_BUCKETS', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+)
+QUERY_BUCKETS = tuple(getattr(django_settings, 'API_METRICS_QUERY_BUCKETS', (1, 2, 5, 10, 20, 50, 100, 200, 500)))
+
+_lock = threading.Lock()
+_endpoint_metrics = {}
+
+
+def instrumentation_enabled():
+    """Return True if API requests should be timed (`API_INSTRUMENTATION`, default True)."""
+    return getattr(django_settings, 'API_INSTRUMENTATION', True)
+
+
+class RequestMetrics:
+    """The timings of a single request.
+
+    It is installed on the database connections with `execute_wrapper()` to count and time the queries.
+
+    Args:
+        capture_queries (bool): Whether to keep the SQL of each query so a slow request can be recorded.
+    """
+
+    def __init__(self, capture_queries=False):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.phases = {}
+        self.queries = 0
+        self.sql_time = 0.0
+        self.capture_queries = capture_queries
+        self.captured_queries = []
+        self.availability = None
+        self.restriction = None
+        self._open_phases = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Run the query, counting it and adding the time it takes to the SQL time."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_time += duration
+            self.queries += 1
+            if self.capture_queries:
+                self.captured_queries.append((context['connection'].alias, sql, params, many, duration))
+
+    def add_time(self, phase, seconds):
+        """Add time to a phase of the request."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def start_phase(self, phase):
+        """Start timing a phase which is ended with `end_phase()`."""
+        self._open_phases[phase] = time.perf_counter()
+
+    def end_phase(self, phase):
+        """End the timing of a phase started with `start_phase()`, if it was started."""
+        started = self._open_phases.pop(phase, None)
+        if started is not None:
+            self.add_time(phase, time.perf_counter() - started)
+
+    def finish(self):
+        """Record the total time of the request and end any phases still being timed."""
+        for phase in list(self._open_phases):
+            self.end_phase(phase)
+        self.duration = time.perf_counter() - self.started
+
+    def get_server_timing(self):
+        """Return the value of the Server-Timing header for the request."""
+        entries = ['%s;dur=%.1f' % (phase, seconds * 1000) for phase, seconds in self.phases.items()]
+        entries.append('sql;dur=%.1f;desc="%d queries"' % (self.sql_time * 1000, self.queries))
+        entries.append('total;dur=%.1f' % (self.duration * 1000))
+        return ', '.join(entries)
+
+
+def get_request_metrics(request):
+    """Return the RequestMetrics of the request or None if it is not being timed.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+    """
+    # the metrics are always kept on the django request so that they are shared with the drf request which wraps it
+    request = getattr(request, '_request', request)
+    return getattr(request, '_api_metrics', None)
+
+
+@contextmanager
+def timed(request, phase):
+    """Add the time taken by the block to a phase of the request, if the request is being timed."""
+    metrics = get_request_metrics(request)
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(phase, time.perf_counter() - started)
+
+
+def start_phase(request, phase):
+    """Start timing a phase of the request, if the request is being timed."""
+    metrics = get_request_metrics(request)
+    if metrics is not None:
+        metrics.start_phase(phase)
+
+
+def end_phase(request, phase):
+    """End the timing of a phase of the request started with `start_phase()`."""
+    metrics = get_request_metrics(request)
+    if metrics is not None:
+        metrics.end_phase(phase)
+
+
+def record_restrictions(request, availability, restriction):
+    """Record the availability of the model and the filter it added to the request, if the request is being timed.
+
+    Args:
+        request (django.http.HttpRequest|rest_framework.request.Request): The current request.
+        availability (str): The AVAILABILITY of the model.
+        restriction (django.db.models.Q|None): The filter applied to the items the user can see, if there is one.
+    """
+    metrics = get_request_metrics(request)
+    if metrics is not None:
+        metrics.availability = availability
+        metrics.restriction = str(restriction) if restriction is not None else None
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.queries = _Histogram(QUERY_BUCKETS)
+        self.sql_time = 0.0
+        self.phases = {}
+        self.statuses = {}
+
+
+def _get_labels(kwargs, view):
+    app = kwargs.get('app', '')
+    model = kwargs.get('model', '')
+    if app and get_endpoint(app, model) is None:
+        # requests for models which don't exist share one set of metrics so the number of labels can't grow
+        app = model = 'unknown'
+    return (app, model, view)
+
+
+def record_request(labels, metrics, status_code):
+    """Add the metrics of a finished request to the metrics of its endpoint.
+
+    Args:
+        labels (tuple): The app, model and view of the request.
+        metrics (RequestMetrics): The metrics of the request.
+        status_code (int): The status code of the response.
+    """
+    with _lock:
+        endpoint_metrics = _endpoint_metrics.get(labels)
+        if endpoint_metrics is None:
+            endpoint_metrics = _endpoint_metrics[labels] = _EndpointMetrics()
+        endpoint_metrics.latency.observe(metrics.duration)
+        endpoint_metrics.queries.observe(metrics.queries)
+        endpoint_metrics.sql_time += metrics.sql_time
+        for phase, seconds in metrics.phases.items():
+            endpoint_metrics.phases[phase] = endpoint_metrics.phases.get(phase, 0.0) + seconds
+        endpoint_metrics.statuses[status_code] = endpoint_metrics.statuses.get(status_code, 0) + 1
+
+
+def reset_metrics():
+    """Remove all of the metrics recorded by this process."""
+    with _lock:
+        _endpoint_metrics.clear()
+
+
+def instrument(view):
+    """Time the requests handled by a view and record them in the metrics of the endpoint.
+
+    The queries run by the request are counted and timed and the response is rendered inside the timing so its time
+    is included. If `API_SERVER_TIMING` is True (default False) the timings are also returned in a Server-Timing
+    header. Requests are only timed when `API_INSTRUMENTATION` is True (the default). Requests which take longer than
+    `API_SLOW_REQUEST_THRESHOLD` seconds are recorded with the plans of their slowest queries (see `slow_requests.py`).
+
+    Args:
+        view (str): The name of the view used in the metrics, for example 'list'.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrap(request, *args, **kwargs):
+            if not instrumentation_enabled():
+                return function(request, *args, **kwargs)
+            threshold = get_slow_request_threshold()
+            metrics = RequestMetrics(capture_queries=threshold is not None)
+            request._api_metrics = metrics
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = function(request, *args, **kwargs)
+                if getattr(response, 'is_rendered', True) is False:
+                    with timed(request, 'render'):
+                        response.render()
+            metrics.finish()
+            labels = _get_labels(kwargs, view)
+            record_request(labels, metrics, response.status_code)
+            if threshold is not None and metrics.duration >= threshold:
+                record_slow_request(request, labels, metrics, response.status_code)
+            if getattr(django_settings, 'API_SERVER_TIMING', False):
+                response['Server-Timing'] = metrics.get_server_timing()
+            return response
+
+        return wrap
+
+    return decorator
+
+
+def _format_labels(labels, **extra):
+    # the app and model names can only contain letters and underscores so they never need escaping
+    names = dict(zip(('app', 'model', 'view'), labels), **extra)
+    return ','.join('%s="%s"' % (name, value) for name, value in names.items())
+
+
+def _format_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket{%s} %d' % (name, _format_labels(labels, le='%g' % bound), cumulative))
+    cumulative += histogram.counts[-1]
+    lines.append('%s_bucket{%s} %d' % (name, _format_labels(labels, le='+Inf'), cumulative))
+    lines.append('%s_sum{%s} %r' % (name, _format_labels(labels), histogram.total))
+    lines.append('%s_count{%s} %d' % (name, _format_labels(labels), cumulative))
+
+
+def get_prometheus_metrics():
+    """Return the metrics recorded by this process in the Prometheus text format.
+
+    Returns:
+        str: The metrics.
+    """
+    with _lock:
+        endpoints = sorted(_endpoint_metrics.items())
+        lines = [
+            '# HELP api_request_duration_seconds The time taken to handle API requests.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        for labels, endpoint_metrics in endpoints:
+            _format_histogram(lines, 'api_request_duration_seconds', labels, endpoint_metrics.latency)
+        lines.extend(
+            [
+                '# HELP api_request_queries The number of database queries run by API requests.',
+                '# TYPE api_request_queries histogram',
+            ]
+        )
+        for labels, endpoint_metrics in endpoints:
+            _format_histogram(lines, 'api_request_queries', labels, endpoint_metrics.queries)
+        lines.extend(
+            [
+                '# HELP api_request_sql_seconds_total The time API requests have spent running database queries.',
+                '# TYPE api_request_sql_seconds_total counter',
+            ]
+        )
+        for labels, endpoint_metrics in endpoints:
+            lines.append('api_request_sql_seconds_total{%s} %r' % (_format_labels(labels), endpoint_metrics.sql_time))
+        lines.extend(
+            [
+                '# HELP api_request_phase_seconds_total The time API requests have spent in each phase of handling.',
+                '# TYPE api_request_phase_seconds_total counter',
+            ]
+        )
+        for labels, endpoint_metrics in endpoints:
+            for phase, seconds in sorted(endpoint_metrics.phases.items()):
+                lines.append('api_request_phase_seconds_total{%s} %r' % (_format_labels(labels, phase=phase), seconds))
+        lines.extend(
+            [
+                '# HELP api_responses_total The number of API responses by status code.',
+                '# TYPE api_responses_total counter',
+            ]
+        )
+        for labels, endpoint_metrics in endpoints:
+            for status_code, count in sorted(endpoint_metrics.statuses.items()):
+                lines.append('api_responses_total{%s} %d' % (_format_labels(labels, status=status_code), count))
+    cache_stats = get_response_cache_stats()
+    lines.extend(
+        [
+            '# HELP api_response_cache_requests_total The requests which were looked up in the shared response cache.',
+            '# TYPE api_response_cache_requests_total counter',
+            'api_response_cache_requests_total{result="hit"} %d' % cache_stats['hits'],
+            'api_response_cache_requests_total{result="miss"} %d' % cache_stats['misses'],
+        ]
+    )
+    return '\n'.join(lines) + '\n'
@@ -1,4 +1,12 @@
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+_UNCHECKED = object()
+
+
+class VersionConflict(Exception):
+    """Raised when an instance is saved but the version in the database is not the one that was expected."""
 
 
 class BaseModel(models.Model):
@@ -6,17 +14,56 @@ class BaseModel(models.Model):
 
     Any model which needs to be accessed via the api should inherit this class or implement the fields and functions
     here. For optmistic concurrency control to work this model must be inherited.
+
+    The version number is set to 1 when an instance is created and is increased by the database in the same UPDATE
+    statement that saves any changes. If an expected version has been set with `set_expected_version()` the UPDATE
+    only matches the row if it still has that version and `VersionConflict` is raised if it does not.
     """
 
     created_time = models.DateTimeField(null=True)
     created_by = models.TextField(verbose_name='Created by', blank=True)
     last_modified_time = models.DateTimeField(null=True)
     last_modified_by = models.TextField(verbose_name='Last modified by', blank=True)
-    version_number = models.IntegerField(null=True)  # has to be null because set in post_save on create
+    version_number = models.IntegerField(null=True)  # null for rows saved before versioning was handled on save
 
     def get_serialization_fields():
         fields = '__all__'
         return fields
 
+    def set_expected_version(self, version_number):
+        """Only allow the next save to update the database if the row still has this version number."""
+        self._expected_version = version_number
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.version_number = 1
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs):
+        version_field = self._meta.get_field('version_number')
+        if version_field not in base_qs.model._meta.local_concrete_fields:
+            # this is the table of a parent or child model which does not hold the version
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs)
+
+        expected_version = getattr(self, '_expected_version', _UNCHECKED)
+        self._expected_version = _UNCHECKED
+        values = [value for value in values if value[0] is not version_field]
+        values.append((version_field, None, Coalesce(F('version_number'), Value(0)) + 1))
+        if expected_version is not _UNCHECKED:
+            base_qs = base_qs.filter(version_number=expected_version)
+
+        updated = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs)
+        if updated:
+            if expected_version is _UNCHECKED:
+                expected_version = self.version_number
+            self.version_number = (expected_version or 0) + 1
+        elif expected_version is not _UNCHECKED:
+            # nothing was updated but if the row is there it must have been changed by someone else
+            if base_qs.model._base_manager.using(using).filter(pk=pk_val).exists():
+                raise VersionConflict(
+                    '%s %s is no longer at version %s' % (self._meta.object_name, pk_val, expected_version)
+                )
+        return updated
+
     class Meta:
         abstract = True
@@ -0,0 +1,376 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings as django_settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from api.caching import get_cache, get_queryset_key
+from api.search_helpers import get_to_many_relation
+
+COUNT_STRATEGIES = ['exact', 'cached', 'estimated', 'none']
+
+
+class SelectPagePaginator(LimitOffsetPagination):
+    """A paginator which can select a page based on a page number (not offset).
+
+    The way the total number of results is counted is chosen by the `_count` option in the request, the
+    `COUNT_STRATEGY` of the model or the `API_COUNT_STRATEGY` setting (in that order). The strategies are:
+
+    - exact - a `COUNT(*)` query.
+    - cached - an exact count which is cached per query and invalidated when the model or a related model changes.
+    - estimated - the row estimate of the query planner (PostgreSQL only, other databases use an exact count).
+      Estimates lower than `API_ESTIMATED_COUNT_THRESHOLD` are replaced with an exact count.
+    - none - no count is made, an extra row is retrieved to find out whether there is a next page.
+    """
+
+    count_strategy = 'exact'
+
+    def get_count_strategy(self, queryset, request):
+        """Return the count strategy to use for this request."""
+        strategy = request.query_params.get('_count')
+        if strategy not in COUNT_STRATEGIES:
+            strategy = getattr(queryset.model, 'COUNT_STRATEGY', None)
+        if strategy not in COUNT_STRATEGIES:
+            strategy = getattr(django_settings, 'API_COUNT_STRATEGY', 'exact')
+        return strategy
+
+    def get_count(self, queryset):
+        """Return the number of results using the count strategy selected for the request."""
+        if self.count_strategy == 'cached':
+            return self._get_cached_count(queryset)
+        if self.count_strategy == 'estimated':
+            return self._get_estimated_count(queryset)
+        return queryset.count()
+
+    def _get_cached_count(self, queryset):
+        cache = get_cache()
+        try:
+            key = get_queryset_key('count', queryset.order_by())
+        except EmptyResultSet:
+            return 0
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(django_settings, 'API_COUNT_CACHE_TIMEOUT', 300))
+        return count
+
+    def _get_estimated_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return queryset.count()
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate < getattr(django_settings, 'API_ESTIMATED_COUNT_THRESHOLD', 10000):
+            return queryset.count()
+        return estimate
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return a single page of results, or `None` if pagination is disabled."""
+        self.count_strategy = self.get_count_strategy(queryset, request)
+        if self.count_strategy != 'none':
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = None
+        results = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[: self.limit]
+
+    def get_next_link(self):
+        """Return the link to the next page or None if this is the last page."""
+        if self.count is not None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def paginate_queryset_and_get_page(self, queryset, request, view=None, index_required=None):
+        """Return the portion of the query set representing the requested page."""
+        self.limit = self.get_limit(request)
+
+        if self.limit is None:
+            return None
+
+        # the page can only be selected if the total is known
+        self.count_strategy = self.get_count_strategy(queryset, request)
+        if self.count_strategy == 'none':
+            self.count_strategy = 'exact'
+        self.offset = self.get_offset(request)
+        self.count = self.get_count(queryset)
+
+        if index_required is not None:
+            page = int(index_required / self.limit)
+            self.offset = page * self.limit
+
+        self.request = request
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+
+        return (list(queryset[self.offset : self.offset + self.limit]), self.offset)
+
+
+class _CursorEncoder(json.JSONEncoder):
+    """JSON encoder for cursor values which, unlike DjangoJSONEncoder, keeps the full precision of times."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (decimal.Decimal, uuid.UUID)):
+            return str(o)
+        return super().default(o)
+
+
+def get_ordering_keys(model, sort_by=None):
+    """Return the keys used to give a queryset a complete, stable ordering.
+
+    The keys are taken from the `_sort` value of the request if there is one and from the ordering in the model Meta
+    class if not. The id is always added as the final key so that no two rows can share a position.
+
+    Args:
+        model (django.db.models.Model): The model being ordered.
+        sort_by (str|None): The comma separated `_sort` value from the request.
+
+    Returns:
+        list: A list of (field, descending) tuples.
+    """
+    if sort_by:
+        sort_fields = [field for field in sort_by.split(',') if field != '']
+    else:
+        sort_fields = [field for field in model._meta.ordering if isinstance(field, str) and field != '?']
+    keys = []
+    for sort_field in sort_fields:
+        descending = sort_field.startswith('-')
+        field = sort_field.lstrip('-+')
+        if field == 'pk':
+            field = 'id'
+        if '__' not in field:
+            # ordering by a foreign key itself would use the ordering of the related model so use the column instead
+            try:
+                model_field = model._meta.get_field(field)
+            except Exception:
+                model_field = None
+            if model_field is not None and model_field.many_to_one:
+                field = model_field.attname
+        keys.append((field, descending))
+        if field == 'id':
+            break
+    if 'id' not in [key[0] for key in keys]:
+        keys.append(('id', False))
+    return keys
+
+
+def has_to_many_keys(model, keys):
+    """Return True if any of the ordering keys follows a many-to-many or reverse relation.
+
+    Args:
+        model (django.db.models.Model): The model being ordered.
+        keys (list): The (field, descending) tuples returned by `get_ordering_keys`.
+
+    Returns:
+        bool: Whether the ordering joins a to-many relation, giving a row for each related item.
+    """
+    return any(get_to_many_relation(model, field) for field, descending in keys)
+
+
+def order_by_keys(queryset, keys, reverse=False):
+    """Order the queryset by the keys with nulls always last in the listed direction.
+
+    Args:
+        queryset (django.db.models.QuerySet): The queryset to order.
+        keys (list): The (field, descending) tuples returned by `get_ordering_keys`.
+        reverse (bool): Whether to reverse the ordering (used to walk backwards from a cursor).
+
+    Returns:
+        django.db.models.QuerySet: The ordered queryset.
+    """
+    # False is deprecated for these arguments in newer versions of Django so only the one in use is set
+    nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+    ordering = []
+    for field, descending in keys:
+        if descending != reverse:
+            ordering.append(F(field).desc(**nulls))
+        else:
+            ordering.append(F(field).asc(**nulls))
+    return queryset.order_by(*ordering)
+
+
+def seek_filter(keys, values, forward=True):
+    """Return a Q object selecting the rows which come after (or before) the row with the given key values.
+
+    The comparison is made on the full ordering, with ties on each key being broken by the next one, and follows
+    the ordering given by `order_by_keys` in which nulls come last.
+
+    Args:
+        keys (list): The (field, descending) tuples returned by `get_ordering_keys`.
+        values (list): The values of each key in the row to seek from.
+        forward (bool): True for the rows after the row, False for the rows before it.
+
+    Returns:
+        django.db.models.Q: The filter to apply to the ordered queryset.
+    """
+    query = Q(pk__in=[])
+    equal = Q()
+    for (field, descending), value in zip(keys, values):
+        if value is None:
+            # nulls are last so only other nulls can be level with or come after a null
+            if not forward:
+                query |= equal & Q(('%s__isnull' % field, False))
+            equal &= Q(('%s__isnull' % field, True))
+        else:
+            operator = 'lt' if descending == forward else 'gt'
+            beyond = Q(('%s__%s' % (field, operator), value))
+            if forward and field != 'id':
+                beyond |= Q(('%s__isnull' % field, True))
+            query |= equal & beyond
+            equal &= Q((field, value))
+    return query
+
+
+def get_key_value(item, field):
+    """Return the value of an ordering key from a model instance or a dictionary of values.
+
+    Args:
+        item (django.db.models.Model|dict): The row.
+        field (str): The key, which may follow relations using `__`.
+
+    Returns:
+        object: The value of the key in this row.
+    """
+    if isinstance(item, dict):
+        return item[field]
+    value = item
+    for part in field.split('__'):
+        if value is None:
+            return None
+        value = getattr(value, part)
+    return value
+
+
+class KeysetPaginator(BasePagination):
+    """A paginator which seeks to each page using the values of the ordering keys (keyset pagination).
+
+    The cost of retrieving a page does not depend on how deep in the results it is because rather than using OFFSET
+    the query starts directly after the last row of the previous page. The next and previous links contain opaque
+    cursors that encode the position.
+    """
+
+    default_limit = api_settings.PAGE_SIZE
+    limit_query_param = 'limit'
+    cursor_query_param = '_cursor'
+    max_limit = None
+    invalid_cursor_message = 'Invalid cursor'
+    to_many_sort_message = 'Lists sorted by a field of a many-to-many or reverse relation cannot use a cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return the page of results following the cursor in the request."""
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.keys = get_ordering_keys(queryset.model, request.query_params.get('_sort'))
+        if has_to_many_keys(queryset.model, self.keys):
+            # the join gives a row for each related item so items would repeat and the cursors would not be unique
+            raise ValidationError({'_sort': [self.to_many_sort_message]})
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['d'] == 'p'
+
+        queryset = order_by_keys(queryset, self.keys, reverse=reverse)
+        if cursor is not None:
+            queryset = queryset.filter(seek_filter(self.keys, cursor['v'], forward=not reverse))
+
+        results = list(queryset[: self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[: self.limit]
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        if results:
+            self.first_values = [get_key_value(results[0], field) for field, descending in self.keys]
+            self.last_values = [get_key_value(results[-1], field) for field, descending in self.keys]
+        else:
+            self.has_next = False
+            self.has_previous = False
+        return results
+
+    def get_paginated_response(self, data):
+        """Return the response for a page of results."""
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
+
+    def get_limit(self, request):
+        """Return the page size requested or the default if there isn't one."""
+        try:
+            return _positive_int(request.query_params[self.limit_query_param], strict=True, cutoff=self.max_limit)
+        except (KeyError, ValueError):
+            return self.default_limit
+
+    def decode_cursor(self, request):
+        """Return the decoded cursor from the request or None if this is the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(cursor, dict)
+            or cursor.get('d') not in ['n', 'p']
+            or not isinstance(cursor.get('v'), list)
+            or len(cursor['v']) != len(self.keys)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, direction, values):
+        """Return the url for the page in the given direction from the row with the given key values."""
+        data = json.dumps({'d': direction, 'v': values}, cls=_CursorEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        """Return the link to the next page or None if this is the last page."""
+        if not self.has_next:
+            return None
+        return self.encode_cursor('n', self.last_values)
+
+    def get_previous_link(self):
+        """Return the link to the previous page or None if this is the first page."""
+        if not self.has_previous:
+            return None
+        return self.encode_cursor('p', self.first_values)
@@ -0,0 +1,327 @@
+import functools
+import logging
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings as django_settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connections
+from django.db.models import ForeignObjectRel, Prefetch
+from rest_framework import serializers
+
+from api.serializers import get_fieldset_serializer_class
+
+logger = logging.getLogger(__name__)
+
+# the number of query plans kept for the combinations of endpoint, serializer and fields requested
+QUERY_PLAN_CACHE_SIZE = getattr(django_settings, 'API_QUERY_PLAN_CACHE_SIZE', 256)
+
+
+class QueryPlan:
+    """The columns and relations needed to serialize a set of fields.
+
+    Args:
+        only (list|None): The fields to load with `only()`, including fields of related models selected with
+            `select_related()`, or None if all of the columns are needed.
+        related_keys (list): The relations to load with `select_related()`.
+        prefetches (list): The (lookup, model, plan) tuples of the relations to prefetch. The plan is the QueryPlan
+            for the related model or None if the lookup is prefetched as it is.
+    """
+
+    def __init__(self, only, related_keys, prefetches):
+        self.only = only
+        self.related_keys = related_keys
+        self.prefetches = prefetches
+
+    def __repr__(self):
+        return '<QueryPlan: only=%s related=%s prefetch=%s>' % (self.only, self.related_keys, self.prefetches)
+
+    def get_prefetch_lookups(self):
+        """Return the lookups to pass to `prefetch_related()`.
+
+        New Prefetch objects are made each time as they are changed by Django when they are used.
+        """
+        lookups = []
+        for lookup, model, plan in self.prefetches:
+            if plan is None:
+                lookups.append(lookup)
+            else:
+                lookups.append(Prefetch(lookup, queryset=plan.apply(model._default_manager.all())))
+        return lookups
+
+    def apply(self, queryset, extra_columns=(), prefetch=True):
+        """Return the queryset with the planned relations loaded and only the planned columns read.
+
+        Args:
+            queryset (django.db.models.QuerySet): The queryset.
+            extra_columns (iterable): Any other fields which should not be deferred.
+            prefetch (bool): Whether to add the prefetching to the queryset.
+        """
+        if self.related_keys:
+            queryset = queryset.select_related(*self.related_keys)
+        if prefetch and self.prefetches:
+            queryset = queryset.prefetch_related(*self.get_prefetch_lookups())
+        if self.only is not None:
+            queryset = queryset.only(*self.only, *extra_columns)
+        return queryset
+
+
+def _get_model_field(model, name):
+    """Return the field of the model with the name, which may be the accessor of a reverse relation.
+
+    Raises:
+        django.core.exceptions.FieldDoesNotExist: If the model has no such field.
+    """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for relation in model._meta.related_objects:
+            if relation.get_accessor_name() == name:
+                return relation
+        raise
+
+
+def _is_single_relation(field):
+    return field.is_relation and field.concrete and (field.many_to_one or field.one_to_one)
+
+
+def _get_path_plan(model, parts):
+    """Return the (columns, whole relations, select related, prefetch related) needed to read a path from a model.
+
+    Raises:
+        django.core.exceptions.FieldDoesNotExist: If the path does not start with a field of the model.
+    """
+    field = _get_model_field(model, parts[0])
+    if not field.is_relation:
+        # anything further is a key or transform of the column
+        return {parts[0]}, set(), set(), set()
+    if not _is_single_relation(field):
+        if field.many_to_one or field.one_to_one:
+            # a generic foreign key or similar which we can't plan for
+            raise FieldDoesNotExist('%s cannot be planned' % parts[0])
+        return set(), set(), set(), {'__'.join(parts)} if len(parts) > 1 else {parts[0]}
+    if len(parts) == 1:
+        return {parts[0]}, {parts[0]}, set(), set()
+    current = field.related_model
+    # the foreign keys followed to reach the field
+    columns = {parts[0]}
+    for index in range(1, len(parts)):
+        prefix = '__'.join(parts[:index])
+        try:
+            related_field = _get_model_field(current, parts[index])
+        except FieldDoesNotExist:
+            # an attribute of the related item so all of it is needed
+            return columns, {prefix}, {prefix}, set()
+        if not related_field.is_relation:
+            return columns | {'__'.join(parts[: index + 1])}, set(), {prefix}, set()
+        if not _is_single_relation(related_field):
+            return columns, set(), {prefix}, {'__'.join(parts)}
+        columns.add('__'.join(parts[: index + 1]))
+        current = related_field.related_model
+    return columns, {'__'.join(parts)}, {'__'.join(parts)}, set()
+
+
+def _uses_pk_only(field):
+    return isinstance(field, serializers.RelatedField) and field.use_pk_only_optimization()
+
+
+def _get_to_many_plan(field, model_field):
+    """Return the plan for the related model of a to-many relation read by a serializer field, or None."""
+    related_model = model_field.related_model
+    if isinstance(field, serializers.ManyRelatedField) and _uses_pk_only(field.child_relation):
+        plan = QueryPlan([related_model._meta.pk.name], [], [])
+    elif isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.ModelSerializer):
+        plan = _get_serializer_plan(field.child, related_model)
+    else:
+        return None
+    if plan.only is not None and model_field.one_to_many:
+        if not isinstance(model_field, ForeignObjectRel):
+            # a generic relation which needs columns we don't know about
+            return QueryPlan(None, plan.related_keys, plan.prefetches)
+        # the foreign key is needed to match the related items to the items they belong to
+        return QueryPlan(sorted(set(plan.only) | {model_field.field.name}), plan.related_keys, plan.prefetches)
+    return plan
+
+
+def _finish_plan(columns, whole_relations, related_keys, prefetches, known):
+    # a relation is loaded in full if anything needs all of it
+    columns = [
+        column for column in columns if not any(column.startswith(relation + '__') for relation in whole_relations)
+    ]
+    return QueryPlan(
+        sorted(columns) if known else None,
+        [key for key in sorted(related_keys) if not any(other.startswith(key + '__') for other in related_keys)],
+        [(lookup, model, plan) for lookup, (model, plan) in sorted(prefetches.items())],
+    )
+
+
+def _get_serializer_plan(serializer, model):
+    """Return the plan for the data a model serializer reads from an instance of the model.
+
+    Each field is followed to the model field (or path through related models given by its `source`) it reads and
+    nested serializers are planned in the same way for their own model. If any field could read something which
+    can't be known, such as a SerializerMethodField, all of the columns are loaded but the relations that are known
+    are still planned.
+    """
+    known = type(serializer).to_representation is serializers.Serializer.to_representation
+    columns = {model._meta.pk.name}
+    whole_relations = set()
+    related_keys = set()
+    prefetches = {}
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+            known = False
+            continue
+        parts = field.source_attrs
+        try:
+            model_field = _get_model_field(model, parts[0])
+        except FieldDoesNotExist:
+            known = False
+            continue
+        if not model_field.is_relation:
+            columns.add(parts[0])
+        elif _is_single_relation(model_field) and len(parts) > 1:
+            path_columns, path_whole, path_related, path_prefetch = _get_path_plan(model, parts)
+            columns.update(path_columns)
+            whole_relations.update(path_whole)
+            related_keys.update(path_related)
+            prefetches.update((lookup, (None, None)) for lookup in path_prefetch)
+        elif _is_single_relation(model_field):
+            columns.add(parts[0])
+            if _uses_pk_only(field):
+                # only the id is serialized and it is read from the foreign key column
+                continue
+            related_keys.add(parts[0])
+            if not isinstance(field, serializers.ModelSerializer):
+                whole_relations.add(parts[0])
+                continue
+            nested = _get_serializer_plan(field, model_field.related_model)
+            if nested.only is None:
+                whole_relations.add(parts[0])
+            else:
+                columns.update('%s__%s' % (parts[0], column) for column in nested.only)
+            related_keys.update('%s__%s' % (parts[0], key) for key in nested.related_keys)
+            for lookup, related_model, plan in nested.prefetches:
+                prefetches['%s__%s' % (parts[0], lookup)] = (related_model, plan)
+        elif model_field.one_to_one and len(parts) == 1:
+            # the reverse side of a one to one relation
+            related_keys.add(parts[0])
+            whole_relations.add(parts[0])
+        elif model_field.many_to_one or model_field.one_to_one:
+            # a generic foreign key
+            known = False
+        elif len(parts) > 1:
+            prefetches[parts[0]] = (None, None)
+        else:
+            plan = _get_to_many_plan(field, model_field)
+            prefetches[parts[0]] = (model_field.related_model, plan) if plan is not None else (None, None)
+    return _finish_plan(columns, whole_relations, related_keys, prefetches, known)
+
+
+@functools.lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def get_query_plan(endpoint, serializer_class, fields=None):
+    """Return the plan of the columns and relations needed to serialize items of the endpoint's model.
+
+    The serializer for the fields (or the model's serialization fields if None) is inspected, including any nested
+    serializers, to find what it reads. Relations to a single item which are serialized as more than their id are
+    loaded with `select_related()` and to-many relations are prefetched with a Prefetch that only reads the columns
+    their own serializer needs. If the serializer can read things which can't be known, for example with a
+    SerializerMethodField, all of the columns are loaded and the `RELATED_KEYS` and `PREFETCH_KEYS` of the model are
+    added to the relations that could be planned.
+
+    Args:
+        endpoint (api.registry.Endpoint): The endpoint of the model.
+        serializer_class (class): The serializer class.
+        fields (tuple|None): The names of the fields requested or None for the default fields.
+
+    Returns:
+        QueryPlan|None: The plan or None if the serializer can't be planned.
+    """
+    model = endpoint.model
+    if not issubclass(serializer_class, serializers.ModelSerializer):
+        return None
+    if fields is None:
+        fields = model.get_serialization_fields()
+    if not isinstance(fields, str):
+        fields = tuple(fields)
+    try:
+        serializer = get_fieldset_serializer_class(serializer_class, model, fields)(None)
+        plan = _get_serializer_plan(serializer, model)
+    except (ImproperlyConfigured, FieldDoesNotExist):
+        return None
+    if plan.only is not None:
+        return plan
+    related_keys = set(plan.related_keys) | set(endpoint.related_keys)
+    prefetches = plan.prefetches[:]
+    planned = {lookup.split('__')[0] for lookup, related_model, related_plan in prefetches}
+    for key in endpoint.prefetch_keys:
+        if key.split('__')[0] not in planned:
+            prefetches.append((key, None, None))
+    return QueryPlan(
+        None,
+        [key for key in sorted(related_keys) if not any(other.startswith(key + '__') for other in related_keys)],
+        prefetches,
+    )
+
+
+class QueryCounter:
+    """Count the queries run on the database connections it is installed on with `execute_wrapper()`."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count the query and run it."""
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run on every database connection inside the block.
+
+    Yields:
+        QueryCounter: The counter.
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+def query_budget_enabled():
+    """Return True if requests should be checked against the query budget (`API_QUERY_BUDGET_WARNINGS`)."""
+    return getattr(django_settings, 'API_QUERY_BUDGET_WARNINGS', django_settings.DEBUG)
+
+
+def get_query_budget(item_count):
+    """Return the number of queries a request returning `item_count` items is allowed.
+
+    This is `API_QUERY_BUDGET_BASE` (default 10) plus `API_QUERY_BUDGET_PER_ITEM` (default 0.1) for each item, so a
+    request which runs a query for every item it returns goes over the budget.
+    """
+    base = getattr(django_settings, 'API_QUERY_BUDGET_BASE', 10)
+    per_item = getattr(django_settings, 'API_QUERY_BUDGET_PER_ITEM', 0.1)
+    return base + per_item * item_count
+
+
+def check_query_budget(description, query_count, item_count):
+    """Log a warning if a request ran more queries than its budget.
+
+    Args:
+        description (str): The request, used in the warning.
+        query_count (int): The number of queries the request ran.
+        item_count (int): The number of items the request returned.
+
+    Returns:
+        bool: True if the request was within its budget.
+    """
+    budget = get_query_budget(item_count)
+    if query_count <= budget:
+        return True
+    logger.warning(
+        '%s ran %d queries for %d items, more than its budget of %d', description, query_count, item_count, budget
+    )
+    return False
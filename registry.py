@@ -0,0 +1,101 @@
+import importlib
+
+from django.apps import apps
+
+from api.models import BaseModel
+
+_registry = {}
+
+
+class Endpoint:
+    """The API configuration of a model, resolved once so that it does not need to be looked up on every request.
+
+    Args:
+        model (django.db.models.Model): The model class.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.app_label = model._meta.app_label
+        self.model_name = model._meta.model_name
+        self.serializer_class = self._get_serializer_class()
+        self.related_keys = list(getattr(model, 'RELATED_KEYS', None) or [])
+        self.prefetch_keys = list(getattr(model, 'PREFETCH_KEYS', None) or [])
+        self.required_fields = list(getattr(model, 'REQUIRED_FIELDS', None) or [])
+        # None is treated as private as this is the safest default
+        self.availability = getattr(model, 'AVAILABILITY', None) or 'private'
+        try:
+            self.fields = model.get_fields()
+        except AttributeError:
+            self.fields = {}
+        self.project_model = self._get_project_model()
+
+    def __repr__(self):
+        return '<Endpoint: %s.%s>' % (self.app_label, self.model_name)
+
+    def _get_serializer_class(self):
+        try:
+            serializer_name = self.model.SERIALIZER
+        except AttributeError:
+            return None
+        module_name = '%s.serializers' % apps.get_app_config(self.app_label).name
+        try:
+            return getattr(importlib.import_module(module_name), serializer_name)
+        except (ImportError, AttributeError):
+            return None
+
+    def _get_project_model(self):
+        try:
+            return apps.get_model(self.app_label, 'Project')
+        except LookupError:
+            pass
+        # this app doesn't have a project but maybe we specfied a different app in the model
+        try:
+            return apps.get_model(self.model.PROJECT_APP, 'Project')
+        except (AttributeError, LookupError):
+            return None
+
+    def get_project_model(self):
+        """Return the project model used for project based availability.
+
+        Raises:
+            LookupError: If there is no project model for this model.
+        """
+        if self.project_model is None:
+            raise LookupError('No Project model found for %s.%s' % (self.app_label, self.model_name))
+        return self.project_model
+
+
+def build_registry():
+    """Register an endpoint for every concrete model which inherits BaseModel.
+
+    This is called when the app is ready.
+    """
+    for model in apps.get_models():
+        if issubclass(model, BaseModel):
+            _registry[(model._meta.app_label, model._meta.model_name)] = Endpoint(model)
+
+
+def get_endpoint(app, model):
+    """Return the endpoint for a model.
+
+    Models which do not inherit BaseModel but implement its fields are registered the first time they are requested.
+
+    Args:
+        app (str): The app label from the request.
+        model (str): The model name from the request.
+
+    Returns:
+        Endpoint|None: The endpoint or None if there is no such model.
+    """
+    key = (app, model.lower())
+    try:
+        return _registry[key]
+    except KeyError:
+        pass
+    try:
+        endpoint = Endpoint(apps.get_model(app, model))
+    except LookupError:
+        return None
+    _registry[key] = endpoint
+    return endpoint
@@ -1,7 +1,13 @@
 import datetime
+import functools
 import re
 
-from django.db.models import Q
+from django.conf import settings as django_settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Exists, ForeignObjectRel, ManyToManyField, OuterRef, Q
+
+# the number of entries kept in each of the caches of filter related data
+FILTER_CACHE_SIZE = getattr(django_settings, 'API_FILTER_CACHE_SIZE', 1024)
 
 
 def _get_date_field(operator, value):
@@ -15,6 +21,71 @@ def _get_date_field(operator, value):
     return date
 
 
+def _get_matched_value(match, value):
+    return match.group(1)
+
+
+def _get_list_value(match, value):
+    return [value]
+
+
+def _get_fixed_value(fixed_value):
+    return lambda match, value: fixed_value
+
+
+def _get_date_value(operator):
+    return lambda match, value: _get_date_field(operator, value)
+
+
+_TEXT_LOOKUPS = [
+    (re.compile(r'^([^*|]+)\*$'), '__startswith', _get_matched_value),
+    (re.compile(r'^([^*|]+)\*\|i$'), '__istartswith', _get_matched_value),
+    (re.compile(r'^\*([^*|]+)$'), '__endswith', _get_matched_value),
+    (re.compile(r'^\*([^*|]+)\|i$'), '__iendswith', _get_matched_value),
+    (re.compile(r'^\*([^*|]+)\*$'), '__contains', _get_matched_value),
+    (re.compile(r'^\*([^*|]+)\*\|i$'), '__icontains', _get_matched_value),
+    (re.compile(r'^([^*|]+)\|i$'), '__iexact', _get_matched_value),
+]
+
+# each lookup is a compiled pattern for the value, the lookup to add to the field and a function which returns the
+# value to use in the query from the pattern match and the submitted value
+_OPERATOR_LOOKUP = {
+    'CharField': _TEXT_LOOKUPS,
+    'TextField': _TEXT_LOOKUPS,
+    'IntegerField': [
+        (re.compile(r'^>([0-9]+)$'), '__gt', _get_matched_value),
+        (re.compile(r'^>=([0-9]+)$'), '__gte', _get_matched_value),
+        (re.compile(r'^<([0-9]+)$'), '__lt', _get_matched_value),
+        (re.compile(r'^<=([0-9]+)$'), '__lte', _get_matched_value),
+    ],
+    'DateField': [
+        (re.compile(r'^>([0-9]+)$'), '__gt', _get_date_value('>')),
+        (re.compile(r'^>=([0-9]+)$'), '__gte', _get_date_value('>=')),
+        (re.compile(r'^<([0-9]+)$'), '__lt', _get_date_value('<')),
+        (re.compile(r'^<=([0-9]+)$'), '__lte', _get_date_value('<=')),
+    ],
+    'ArrayField': [
+        (re.compile(r'^_eq(\d+)$'), '__len', _get_matched_value),
+        (re.compile(r'^_gt(\d+)$'), '__len__gt', _get_matched_value),
+        (re.compile(r'^(.+)$'), '__contains', _get_list_value),
+    ],
+    'NullBooleanField': [
+        (re.compile(r'^([tT]rue)$'), '', _get_fixed_value(True)),
+        (re.compile(r'^([fF]alse)$'), '', _get_fixed_value(None)),
+    ],
+    'BooleanField': [
+        (re.compile(r'^([tT]rue)$'), '', _get_fixed_value(True)),
+        (re.compile(r'^([fF]alse)$'), '', _get_fixed_value(False)),
+    ],
+    # this assumes that the search is for the value in the JSON field and that that
+    # values is text or char there are more searches specific to JSON fields such as
+    # presence of key which we do not support yet
+    'JSONField': _TEXT_LOOKUPS,
+    'ForeignKey': [],
+    'ManyToManyField': [],
+}
+
+
 def get_related_model(model_instance, field_name):
     """Get the model of a relational field.
 
@@ -31,9 +102,12 @@ def get_related_model(model_instance, field_name):
     return model_instance._meta.get_field(field_name).related_model
 
 
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
 def get_related_field_type(model, field):
     """Return the data type of the related field.
 
+    The results are cached as the fields of a model do not change while the server is running.
+
     Args:
         model (django.db.models.Model): The model containing the relational field.
         field (str): The field name to find the type of.
@@ -71,70 +145,10 @@ def get_query_tuple(field_type, field, value):
     Returns:
         tuple|None: The tuple containing the field and the value to use in the query or None if one can't be created.
     """
-    operator_lookup = {
-        'CharField': [
-            [r'^([^*|]+)\*$', '__startswith'],
-            [r'^([^*|]+)\*\|i$', '__istartswith'],
-            [r'^\*([^*|]+)$', '__endswith'],
-            [r'^\*([^*|]+)\|i$', '__iendswith'],
-            [r'^\*([^*|]+)\*$', '__contains'],
-            [r'^\*([^*|]+)\*\|i$', '__icontains'],
-            [r'^([^*|]+)\|i$', '__iexact'],
-        ],
-        'TextField': [
-            [r'^([^*|]+)\*$', '__startswith'],
-            [r'^([^*|]+)\*\|i$', '__istartswith'],
-            [r'^\*([^*|]+)$', '__endswith'],
-            [r'^\*([^*|]+)\|i$', '__iendswith'],
-            [r'^\*([^*|]+)\*$', '__contains'],
-            [r'^\*([^*|]+)\*\|i$', '__icontains'],
-            [r'^([^*|]+)\|i$', '__iexact'],
-        ],
-        'IntegerField': [
-            [r'^>([0-9]+)$', '__gt'],
-            [r'^>=([0-9]+)$', '__gte'],
-            [r'^<([0-9]+)$', '__lt'],
-            [r'^<=([0-9]+)$', '__lte'],
-        ],
-        'DateField': [
-            [r'^>([0-9]+)$', '__gt', '', ['_get_date_field', '>', value]],
-            [r'^>=([0-9]+)$', '__gte', '', ['_get_date_field', '>=', value]],
-            [r'^<([0-9]+)$', '__lt', '', ['_get_date_field', '<', value]],
-            [r'^<=([0-9]+)$', '__lte', '', ['_get_date_field', '<=', value]],
-        ],
-        'ArrayField': [[r'^_eq(\d+)$', '__len'], [r'^_gt(\d+)$', '__len__gt'], [r'^(.+)$', '__contains']],
-        'NullBooleanField': [[r'^([tT]rue)$', '', True], [r'^([fF]alse)$', '', None]],
-        'BooleanField': [[r'^([tT]rue)$', '', True], [r'^([fF]alse)$', '', False]],
-        # this assumes that the search is for the value in the JSON field and that that
-        # values is text or char there are more searches specific to JSON fields such as
-        # presence of key which we do not support yet
-        'JSONField': [
-            [r'^([^*|]+)\*$', '__startswith'],
-            [r'^([^*|]+)\*\|i$', '__istartswith'],
-            [r'^\*([^*|]+)$', '__endswith'],
-            [r'^\*([^*|]+)\|i$', '__iendswith'],
-            [r'^\*([^*|]+)\*$', '__contains'],
-            [r'^\*([^*|]+)\*\|i$', '__icontains'],
-            [r'^([^*|]+)\|i$', '__iexact'],
-        ],
-        'ForeignKey': [],
-        'ManyToManyField': [],
-    }
-    options = []
-
-    if field_type in operator_lookup:
-        options = operator_lookup[field_type]
-    for option in options:
-        if re.search(option[0], value):
-            if len(option) > 3:
-                value = globals()[option[3][0]](option[3][1], option[3][2])
-                return ('%s%s' % (field, option[1]), value)
-            elif len(option) > 2:
-                return ('%s%s' % (field, option[1]), option[2])
-            elif field_type == 'ArrayField' and '__len' not in option[1]:
-                return ('%s%s' % (field, option[1]), [value])
-            else:
-                return ('%s%s' % (field, option[1]), re.sub(option[0], '\\1', value))
+    for pattern, lookup, get_value in _OPERATOR_LOOKUP.get(field_type, []):
+        match = pattern.search(value)
+        if match:
+            return ('%s%s' % (field, lookup), get_value(match, value))
     if value != '' and field != '' and field_type:
         return (field, value)
     return None
@@ -143,6 +157,9 @@ def get_query_tuple(field_type, field, value):
 def get_field_filters(queryDict, model_instance, type):
     """Create the queries to use as filters.
 
+    The queries are cached for each combination of search fields and values so repeated searches do not need to be
+    parsed again. The Q objects returned are shared between calls and must not be modified in place.
+
     Args:
         queryDict (dict): The query doctionary from the api call.
         model_instance (django.db.models.Model): The model being filtered.
@@ -151,54 +168,194 @@ def get_field_filters(queryDict, model_instance, type):
     Returns:
         list: A list of django.db.models.Q objects.
     """
+    # only the search fields are used as the key so that options such as limit and offset do not affect caching
+    query_items = tuple(
+        (field, tuple(queryDict[field])) for field in queryDict if field not in ['offset', 'limit'] and field[0] != '_'
+    )
+    try:
+        return list(_get_cached_field_filters(query_items, model_instance, type))
+    except TypeError:
+        # the values cannot be used as a key so the queries cannot be cached
+        return list(_get_field_filters(query_items, model_instance, type))
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _get_cached_field_filters(query_items, model_instance, type):
+    return _get_field_filters(query_items, model_instance, type)
+
+
+def _get_field_filters(query_items, model_instance, type):
     model_fields = model_instance.get_fields()
     query = Q()
     additional_queries = []
     query_tuple = None
     m2m_list = []
-    for field in queryDict:
+    for field, value_list in query_items:
         if field == 'project':
             # project used to be in the list below and I have removed it because
             # we might need to filter by project for some things
             print('Project used to be filtered out - check why it was needed and adjust query if necessary!')
-        if field not in ['offset', 'limit'] and field[0] != '_':
-            if field in model_fields:
-                field_type = model_fields[field]
-            elif '__' in field and field.split('__')[0] in model_fields:
-                field_type = model_fields[field.split('__')[0]]
+        if field in model_fields:
+            field_type = model_fields[field]
+        elif '__' in field and field.split('__')[0] in model_fields:
+            field_type = model_fields[field.split('__')[0]]
+        else:
+            field_type = None
+        if field_type == 'ForeignKey' or field_type == 'ManyToManyField':
+            m2m_list.append(field.split('__')[0])
+            field_type = get_related_field_type(model_instance, field)
+        # we do not support negation with OR so these are only done when we are filtering
+        # I just don't think or-ing negatives on the same field key makes any sense
+        for i, value in enumerate(value_list):
+            # these are the OR fields
+            if ',' in value:
+                if type == 'filter':
+                    subquery = Q()
+                    for part in value.split(','):
+                        if part != '':
+                            query_tuple = get_query_tuple(field_type, field, part)
+                            if query_tuple:
+                                subquery |= Q(query_tuple)
+                                query_tuple = None
+                    query &= subquery
             else:
-                field_type = None
-            if field_type == 'ForeignKey' or field_type == 'ManyToManyField':
-                m2m_list.append(field.split('__')[0])
-                field_type = get_related_field_type(model_instance, field)
-            value_list = queryDict[field]
-            # we do not support negation with OR so these are only done when we are filtering
-            # I just don't think or-ing negatives on the same field key makes any sense
-            for i, value in enumerate(value_list):
-                # these are the OR fields
-                if ',' in value:
-                    if type == 'filter':
-                        subquery = Q()
-                        for part in value.split(','):
-                            if part != '':
-                                query_tuple = get_query_tuple(field_type, field, part)
-                                if query_tuple:
-                                    subquery |= Q(query_tuple)
-                                    query_tuple = None
-                        query &= subquery
-                else:
-                    # these are the AND fields
-                    if value != '':
-                        if type == 'exclude' and value[0] == '!':
-                            query_tuple = get_query_tuple(field_type, field, value[1:])
-                        elif type == 'filter' and value[0] != '!':
-                            query_tuple = get_query_tuple(field_type, field, value)
-                        if query_tuple and (i == 0 or field.split('__')[0] not in m2m_list):
-                            query &= Q(query_tuple)
-                            query_tuple = None
-                        elif query_tuple:
-                            additional_queries.append(Q(query_tuple))
+                # these are the AND fields
+                if value != '':
+                    if type == 'exclude' and value[0] == '!':
+                        query_tuple = get_query_tuple(field_type, field, value[1:])
+                    elif type == 'filter' and value[0] != '!':
+                        query_tuple = get_query_tuple(field_type, field, value)
+                    if query_tuple and (i == 0 or field.split('__')[0] not in m2m_list):
+                        query &= Q(query_tuple)
+                        query_tuple = None
+                    elif query_tuple:
+                        additional_queries.append(Q(query_tuple))
 
     queries = [query]
     queries.extend(additional_queries)
-    return queries
+    return tuple(queries)
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def get_to_many_relation(model, lookup):
+    """Return the first relation in a lookup which can match more than one related item.
+
+    The results are cached as the fields of a model do not change while the server is running.
+
+    Args:
+        model (django.db.models.Model): The model the lookup starts from.
+        lookup (str): The lookup, for example `tags__label__startswith`.
+
+    Returns:
+        tuple|None: The path to the relation (a tuple of field names) and the relation field, or None if the lookup
+        only follows relations to a single item.
+    """
+    parts = lookup.split('__')
+    current = model
+    for index, part in enumerate(parts):
+        try:
+            field = current._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not field.is_relation:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return tuple(parts[: index + 1]), field
+        current = field.related_model
+    return None
+
+
+def _get_relation_subquery(relation, field):
+    """Return the queryset of the related model correlated with the outer query and the name of the related lookup.
+
+    Returns None if the relation can't be filtered with a subquery.
+    """
+    outer = OuterRef('__'.join(relation[:-1] + ('pk',)))
+    if isinstance(field, ManyToManyField):
+        remote_name = field.related_query_name()
+    elif isinstance(field, ForeignObjectRel) and field.field.target_field == field.model._meta.pk:
+        remote_name = field.field.name
+    else:
+        # a generic relation or a foreign key to a field which is not the primary key
+        return None
+    return field.related_model._base_manager.filter(**{remote_name: outer})
+
+
+def _get_query_relation(model, query):
+    """Return the to-many relation (path, field) used by every lookup in the query.
+
+    Returns None if none of them use a to-many relation and False if they use more than one, the query is negated or
+    it mixes lookups on the relation with lookups which don't use it, as those can't be moved into the subquery.
+    """
+    if isinstance(query, Q):
+        relations = set()
+        for child in query.children:
+            relations.add(_get_query_relation(model, child))
+        if relations <= {None}:
+            return None
+        if len(relations) > 1 or False in relations or query.negated:
+            return False
+        return relations.pop()
+    if isinstance(query, tuple):
+        return get_to_many_relation(model, query[0])
+    # an expression which we can't look inside
+    return False
+
+
+def _strip_relation(query, relation, related_model):
+    """Return the query with the relation removed from the start of each lookup so it can filter the related model."""
+    if isinstance(query, Q):
+        stripped = Q(*[_strip_relation(child, relation, related_model) for child in query.children])
+        stripped.connector = query.connector
+        stripped.negated = query.negated
+        return stripped
+    lookup, value = query
+    rest = lookup.split('__')[len(relation) :]
+    if not rest:
+        return ('pk', value)
+    try:
+        if rest[0] != 'pk':
+            related_model._meta.get_field(rest[0])
+    except FieldDoesNotExist:
+        # a lookup such as in or gt on the related item itself
+        return ('pk__%s' % '__'.join(rest), value)
+    return ('__'.join(rest), value)
+
+
+def get_subquery_filter(model, query):
+    """Return a version of a filter which uses EXISTS subqueries for to-many relations instead of joins.
+
+    A join to a to-many relation returns a row for each related item that matches, so the results need `distinct()`.
+    Instead the conditions which use the same to-many relation are combined into a single `Exists` subquery. As all of
+    the conditions in a single `filter()` call must be met by the same related item this gives the same results, and
+    conditions in separate `filter()` calls are still met independently as each call is converted separately.
+
+    Args:
+        model (django.db.models.Model): The model being filtered.
+        query (django.db.models.Q): The query for a single call to `filter()`.
+
+    Returns:
+        tuple: The new query and a boolean which is True if it still joins a to-many relation so the results still
+        need `distinct()`.
+    """
+    if query.connector == Q.AND and not query.negated:
+        children = query.children
+    else:
+        children = [query]
+    kept = []
+    groups = {}
+    needs_distinct = False
+    for child in children:
+        relation = _get_query_relation(model, child)
+        if relation is None:
+            kept.append(child)
+        elif relation is False or _get_relation_subquery(*relation) is None:
+            kept.append(child)
+            needs_distinct = True
+        else:
+            groups.setdefault(relation, []).append(child)
+    new_query = Q(*kept)
+    for (relation, field), group in groups.items():
+        related_query = Q(*[_strip_relation(child, relation, field.related_model) for child in group])
+        new_query &= Q(Exists(_get_relation_subquery(relation, field).filter(related_query)))
+    return new_query, needs_distinct
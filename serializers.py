@@ -1,8 +1,61 @@
+import copy
+import functools
+
 from django.apps import apps
+from django.conf import settings as django_settings
 from rest_framework import serializers
 
+# the number of serializer classes kept for the combinations of serializer, model and fields requested
+SERIALIZER_CACHE_SIZE = getattr(django_settings, 'API_SERIALIZER_CACHE_SIZE', 256)
+
+
+@functools.lru_cache(maxsize=SERIALIZER_CACHE_SIZE)
+def get_fieldset_serializer_class(serializer_class, model, fields):
+    """Return a subclass of the serializer which serializes the given fields of the model.
+
+    Each class is only created once for each combination of arguments so the shared serializer classes never need to
+    be changed to serialize a different model or set of fields, which makes it safe for concurrent requests to ask for
+    different fields.
+
+    Args:
+        serializer_class (class): The serializer class.
+        model (django.db.models.Model): The model class.
+        fields (tuple|str): The names of the fields or '__all__'.
+
+    Returns:
+        class: The serializer class.
+    """
+    meta = type('Meta', (serializer_class.Meta,), {'model': model, 'fields': fields})
+    return type(serializer_class.__name__, (serializer_class,), {'Meta': meta, '_fieldset_class': True})
+
+
+def _freeze_fields(fields):
+    if isinstance(fields, str):
+        return fields
+    return tuple(fields)
+
 
-class SimpleSerializer(serializers.ModelSerializer):
+class FieldsetSerializerMixin:
+    """Serializers for a model and set of fields chosen when the serializer is made.
+
+    The serializer classes are replaced with subclasses made by `get_fieldset_serializer_class` and the fields built
+    from the model for each of these are kept on the class so they only need to be built once.
+    """
+
+    _fieldset_class = False
+    _fieldset_fields = None
+
+    def get_fields(self):
+        """Return a copy of the fields of the serializer, building them the first time they are requested."""
+        cls = type(self)
+        if not cls._fieldset_class:
+            return super().get_fields()
+        if cls.__dict__.get('_fieldset_fields') is None:
+            cls._fieldset_fields = super().get_fields()
+        return copy.deepcopy(cls._fieldset_fields)
+
+
+class SimpleSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """A generic serializer for a model.
 
     Used as a backup by the api if no other serializer is specified. it is unlikely to be suitable for anything but
@@ -13,23 +66,27 @@ class SimpleSerializer(serializers.ModelSerializer):
         model = None
         fields = ()
 
-    def __init__(self, instance=None, fields=None, context=None, data=None):
-        if instance:
-            if isinstance(instance, list):
-                self.Meta.model = type(instance[0])
-            else:
-                self.Meta.model = type(instance)
-            if fields:
-                self.Meta.fields = fields
-            else:
-                self.Meta.fields = self.Meta.model.get_serialization_fields()
+    def __new__(cls, *args, **kwargs):
+        if not cls._fieldset_class and not kwargs.get('many', False):
+            instance = args[0] if args else kwargs.get('instance')
+            fields = args[1] if len(args) > 1 else kwargs.get('fields')
+            context = args[2] if len(args) > 2 else kwargs.get('context')
+            model = None
+            if instance:
+                model = type(instance[0]) if isinstance(instance, list) else type(instance)
+            elif context and 'app' in context and 'model' in context:
+                model = apps.get_model(context['app'], context['model'])
+            if model is not None:
+                cls = get_fieldset_serializer_class(
+                    cls, model, _freeze_fields(fields or model.get_serialization_fields())
+                )
+        return super().__new__(cls, *args, **kwargs)
 
-        elif 'app' in context and 'model' in context:
-            self.Meta.model = apps.get_model(context['app'], context['model'])
+    def __init__(self, instance=None, fields=None, context=None, data=None):
         super(SimpleSerializer, self).__init__(instance=instance)
 
 
-class BaseModelSerializer(serializers.ModelSerializer):
+class BaseModelSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     """The serializer for the base model.
 
     This model should be inherited by all other serializers.
@@ -37,17 +94,25 @@ class BaseModelSerializer(serializers.ModelSerializer):
     This takes the Model serializer from Django Rest Framework and makes it more flexible by allowing the
     specification of data in the `__init__` function. This was done to allow the required fields to be specified. This
     can be important when requesting large numbers of records to control the size of the data returned.
+
+    The fields are set on a subclass made for each set of fields (see `get_fieldset_serializer_class`) rather than on
+    the class itself.
     """
 
+    def __new__(cls, *args, **kwargs):
+        if not cls._fieldset_class and not kwargs.get('many', False):
+            if kwargs.get('fields') is not None:
+                fields = _freeze_fields(kwargs['fields'])
+            else:
+                fields = _freeze_fields(cls.Meta.model.get_serialization_fields())
+            cls = get_fieldset_serializer_class(cls, cls.Meta.model, fields)
+        return super().__new__(cls, *args, **kwargs)
+
     def __init__(self, *args, **kwargs):
         if kwargs:
             partial = kwargs.pop('partial', False)
         else:
             partial = False
-        if 'fields' in kwargs:
-            self.Meta.fields = kwargs['fields']
-        else:
-            self.Meta.fields = self.Meta.model.get_serialization_fields()
 
         if len(args) > 0 and 'data' in kwargs:
             super(BaseModelSerializer, self).__init__(instance=args[0], data=kwargs['data'], partial=partial)
@@ -55,3 +120,90 @@ class BaseModelSerializer(serializers.ModelSerializer):
             super(BaseModelSerializer, self).__init__(instance=args[0], partial=partial)
         elif 'data' in kwargs:
             super(BaseModelSerializer, self).__init__(data=kwargs['data'], partial=partial)
+
+
+# serializer fields which need the model instance (or the request) to produce their value
+_INSTANCE_FIELDS = (
+    serializers.ModelField,
+    serializers.FileField,
+    serializers.SerializerMethodField,
+    serializers.BaseSerializer,
+)
+
+
+class ValuesSerializer:
+    """Serialize rows returned by `QuerySet.values()` in the same way as the serializer would serialize instances.
+
+    Args:
+        fields (list): The (name, column, serializer field) tuples of the fields to serialize.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [column for name, column, field in fields]
+
+    def to_representation(self, row):
+        """Return the serialized data for a row."""
+        data = {}
+        for name, column, field in self.fields:
+            value = row[column]
+            if value is None or field is None:
+                data[name] = value
+            else:
+                data[name] = field.to_representation(value)
+        return data
+
+
+@functools.lru_cache(maxsize=SERIALIZER_CACHE_SIZE)
+def get_values_serializer(serializer_class, model, fields):
+    """Return a ValuesSerializer for the fields if the serializer would output each of them directly from a column.
+
+    This is the case for fields which the serializer builds from the model (rather than declaring itself) and which are
+    either a concrete column or a foreign key to the primary key of another model (which is serialized as the id). The
+    serializer must not change its own representation.
+
+    Args:
+        serializer_class (class): The serializer class.
+        model (django.db.models.Model): The model class.
+        fields (tuple): The names of the fields requested.
+
+    Returns:
+        ValuesSerializer|None: The serializer for rows from `values()` or None if the fields cannot be serialized this
+        way.
+    """
+    if not issubclass(serializer_class, serializers.ModelSerializer) or not fields:
+        return None
+    if serializer_class.to_representation is not serializers.Serializer.to_representation:
+        return None
+    if set(fields) & set(serializer_class._declared_fields):
+        return None
+    model_fields = []
+    for name in fields:
+        try:
+            model_fields.append(model._meta.get_field(name))
+        except Exception:
+            return None
+    serializer = get_fieldset_serializer_class(serializer_class, model, _freeze_fields(fields))(None)
+    values_fields = []
+    for name, model_field in zip(fields, model_fields):
+        serializer_field = serializer.fields.get(name)
+        if serializer_field is None or not model_field.concrete or serializer_field.source != name:
+            return None
+        if serializer_field.write_only:
+            continue
+        if model_field.is_relation:
+            if not (model_field.many_to_one or model_field.one_to_one):
+                return None
+            if model_field.target_field != model_field.related_model._meta.pk:
+                return None
+            if type(serializer_field) is not serializers.PrimaryKeyRelatedField:
+                return None
+            if serializer_field.pk_field is not None:
+                return None
+            # the primary key of the related object is output as it is
+            values_fields.append((name, model_field.attname, None))
+        else:
+            if isinstance(serializer_field, _INSTANCE_FIELDS):
+                return None
+            values_fields.append((name, model_field.attname, serializer_field))
+    return ValuesSerializer(values_fields)
@@ -1,5 +1,8 @@
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
+from .caching import bump_model_generation, invalidate_user_groups
 from .models import BaseModel
 
 
@@ -16,26 +19,44 @@ def get_subclasses(cls):
     return result
 
 
-def increment_version(sender, instance, created, **kwargs):
-    """Increment the version number in the instance.
+def invalidate_model_caches(sender, **kwargs):
+    """Invalidate anything cached by the API for the model of an instance that has been saved or deleted."""
+    bump_model_generation(sender)
 
-    Used for optimistic concurrency checks using etag in request header.
-    """
-    if created is True:
-        version_number = 1
+
+def invalidate_m2m_caches(sender, instance, action, model, **kwargs):
+    """Invalidate anything cached by the API for both models when a many-to-many relation changes."""
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        bump_model_generation(type(instance))
+        bump_model_generation(model)
+
+
+def invalidate_group_caches(sender, **kwargs):
+    """Invalidate the cached group names of every user when a group is renamed or deleted."""
+    bump_model_generation(Group)
+
+
+def invalidate_user_group_caches(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate the cached group names of the users whose groups have changed."""
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        invalidate_user_groups(Group, [instance.pk])
+    elif pk_set:
+        invalidate_user_groups(Group, pk_set)
     else:
-        version_number = instance.version_number
-        try:
-            version_number += 1
-        except TypeError:
-            version_number = 1  # just in case something got saved with null
+        # a group has been cleared so we don't know which users were in it
+        bump_model_generation(Group)
 
-    # we can't save in a post_save or we get stuck in a recursion nightmare
-    # Lots of places online say disconnect and reconnect the signal around the
-    # save call but that felt wrong to me so I am using update instead of save
-    # which does not trigger the post_save signal
-    sender.objects.filter(id=instance.id).update(version_number=version_number)
 
+post_save.connect(invalidate_group_caches, Group)
+post_delete.connect(invalidate_group_caches, Group)
+if hasattr(get_user_model(), 'groups'):
+    m2m_changed.connect(invalidate_user_group_caches, sender=get_user_model().groups.through)
 
 for subclass in get_subclasses(BaseModel):
-    post_save.connect(increment_version, subclass)
+    post_save.connect(invalidate_model_caches, subclass)
+    post_delete.connect(invalidate_model_caches, subclass)
+    if not subclass._meta.abstract:
+        for field in subclass._meta.local_many_to_many:
+            m2m_changed.connect(invalidate_m2m_caches, sender=field.remote_field.through)
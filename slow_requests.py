@@ -0,0 +1,136 @@
+import collections
+import datetime
+import logging
+import threading
+
+from django.conf import settings as django_settings
+from django.db import DatabaseError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# the number of slow requests kept by each process, the oldest are dropped first
+SLOW_REQUEST_BUFFER_SIZE = getattr(django_settings, 'API_SLOW_REQUEST_BUFFER_SIZE', 100)
+
+_lock = threading.Lock()
+_slow_requests = collections.deque(maxlen=SLOW_REQUEST_BUFFER_SIZE)
+
+
+def get_slow_request_threshold():
+    """Return the time in seconds above which a request is recorded, or None if slow requests are not recorded.
+
+    This is the `API_SLOW_REQUEST_THRESHOLD` setting which is None by default.
+    """
+    return getattr(django_settings, 'API_SLOW_REQUEST_THRESHOLD', None)
+
+
+def explain_query(alias, sql, params):
+    """Return the query plan of a query as text.
+
+    The query is explained with the prefix of the database (`EXPLAIN` or `EXPLAIN QUERY PLAN` on SQLite) and the rows
+    are formatted in the same way as `QuerySet.explain()`. It is run in a savepoint so that an error does not break a
+    transaction the request is still in.
+
+    Args:
+        alias (str): The alias of the database connection the query was run on.
+        sql (str): The SQL of the query.
+        params (list|tuple|dict|None): The parameters of the query.
+
+    Returns:
+        str: The query plan or the reason it could not be found.
+    """
+    connection = connections[alias]
+    try:
+        with transaction.atomic(using=alias):
+            with connection.cursor() as cursor:
+                cursor.execute('%s %s' % (connection.ops.explain_query_prefix(), sql), params)
+                rows = cursor.fetchall()
+    except DatabaseError as error:
+        return 'The query could not be explained: %s' % error
+    return '\n'.join(row if isinstance(row, str) else ' '.join(str(value) for value in row) for row in rows)
+
+
+def _get_params(params):
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: _get_param(value) for key, value in params.items()}
+    return [_get_param(value) for value in params]
+
+
+def _get_param(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _get_query_record(query):
+    alias, sql, params, many, duration = query
+    record = {'sql': sql, 'params': _get_params(params) if not many else [], 'duration_ms': round(duration * 1000, 3)}
+    if not many and sql.lstrip()[:6].upper() in ('SELECT', 'WITH'):
+        record['explain'] = explain_query(alias, sql, params)
+    return record
+
+
+def record_slow_request(request, labels, metrics, status_code):
+    """Record a request which took longer than the threshold along with the plans of its slowest queries.
+
+    The record is added to the buffer read by `get_slow_requests()` and logged as a warning to the
+    `api.slow_requests` logger. The `API_SLOW_REQUEST_EXPLAIN` (default 3) slowest queries are explained.
+
+    Args:
+        request (django.http.HttpRequest): The request.
+        labels (tuple): The app, model and view of the request.
+        metrics (api.metrics.RequestMetrics): The metrics of the request, with its queries.
+        status_code (int): The status code of the response.
+
+    Returns:
+        dict: The record.
+    """
+    explain_count = getattr(django_settings, 'API_SLOW_REQUEST_EXPLAIN', 3)
+    slowest = sorted(metrics.captured_queries, key=lambda query: query[4], reverse=True)[:explain_count]
+    user = getattr(request, 'user', None)
+    record = {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'app': labels[0],
+        'model': labels[1],
+        'view': labels[2],
+        'method': request.method,
+        'path': request.path,
+        'query_string': request.META.get('QUERY_STRING', ''),
+        'user': user.get_username() if user is not None and user.is_authenticated else None,
+        'status': status_code,
+        'duration_ms': round(metrics.duration * 1000, 3),
+        'sql_ms': round(metrics.sql_time * 1000, 3),
+        'query_count': metrics.queries,
+        'availability': metrics.availability,
+        'restriction': metrics.restriction,
+        'queries': [_get_query_record(query) for query in slowest],
+    }
+    with _lock:
+        _slow_requests.append(record)
+    logger.warning(
+        'Slow API request: %s %s took %.1fms with %d queries (%s)',
+        record['method'],
+        request.get_full_path(),
+        record['duration_ms'],
+        record['query_count'],
+        record['restriction'] or record['availability'] or 'unrestricted',
+        extra={'slow_request': record},
+    )
+    return record
+
+
+def get_slow_requests():
+    """Return the slow requests recorded by this process, the most recent first.
+
+    Returns:
+        list: The records.
+    """
+    with _lock:
+        return list(reversed(_slow_requests))
+
+
+def clear_slow_requests():
+    """Remove all of the slow requests recorded by this process."""
+    with _lock:
+        _slow_requests.clear()
@@ -11,7 +11,7 @@ var api = (function (){
   // temporary promise public functions will replace non-promise versions eventually
   var createItemInDatabasePromise, updateItemInDatabasePromise, updateFieldsInDatabasePromise,
   getItemFromDatabasePromise, getItemsFromDatabasePromise, deleteItemFromDatabasePromise,
-  deleteM2MItemFromDatabasePromise, getCurrentUserPromise;
+  deleteM2MItemFromDatabasePromise, getCurrentUserPromise, batchRequestsPromise;
 
   csrfSafeMethod = function (method) {
     // these HTTP methods do not require CSRF protection
@@ -361,6 +361,22 @@ var api = (function (){
   };
 
 
+  batchRequestsPromise = function (requests, atomic, consistent) {
+    return new Promise(function (resolve, reject) {
+      $.ajax({'url': '/api/batch',
+          'headers': {'Content-Type': 'application/json'},
+          'dataType': 'json',
+          'method': 'POST',
+          'data': JSON.stringify({'requests': requests, 'atomic': atomic === true, 'consistent': consistent === true})}
+      ).then(function (response) {
+        resolve(response.results);
+      }).catch(function (response) {
+        reject(response);
+      });
+    });
+  };
+
+
   return {
     setupAjax: setupAjax,
     createItemInDatabase: createItemInDatabase,
@@ -378,6 +394,7 @@ var api = (function (){
     deleteItemFromDatabasePromise: deleteItemFromDatabasePromise,
     deleteM2MItemFromDatabasePromise: deleteM2MItemFromDatabasePromise,
     getCurrentUserPromise: getCurrentUserPromise,
+    batchRequestsPromise: batchRequestsPromise,
     getCurrentUser: getCurrentUser,
     getCSRFToken: getCSRFToken
   };
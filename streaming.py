@@ -0,0 +1,107 @@
+import csv
+import json
+
+from django.conf import settings as django_settings
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class _Echo:
+    """An object with the write method of a file which returns what is written so csv.writer can be used in a stream."""
+
+    def write(self, value):
+        return value
+
+
+def iterate_in_chunks(queryset, chunk_size=None, prefetch_keys=None):
+    """Yield the instances in a queryset in lists of at most `chunk_size` without caching the whole result.
+
+    The queryset is read with `iterator()` so server-side cursors are used where the database supports them. Any
+    prefetching is done separately for each chunk.
+
+    Args:
+        queryset (django.db.models.QuerySet): The queryset to read.
+        chunk_size (int|None): The number of instances in each chunk, `API_STREAM_CHUNK_SIZE` (default 500) if None.
+        prefetch_keys (list|None): The relations to prefetch for each chunk.
+
+    Yields:
+        list: The next chunk of instances.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(django_settings, 'API_STREAM_CHUNK_SIZE', 500)
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            if prefetch_keys:
+                prefetch_related_objects(chunk, *prefetch_keys)
+            yield chunk
+            chunk = []
+    if chunk:
+        if prefetch_keys:
+            prefetch_related_objects(chunk, *prefetch_keys)
+        yield chunk
+
+
+def _to_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+    return value
+
+
+def stream_ndjson(rows):
+    """Yield each row as a line of JSON."""
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+def stream_csv(rows, columns=None):
+    """Yield the rows as CSV lines with a header row.
+
+    Args:
+        rows (iterable): The serialized rows.
+        columns (list|None): The columns to include, taken from the first row if None.
+    """
+    writer = csv.writer(_Echo())
+    if columns is not None:
+        # the header can be sent before any of the rows have been read
+        yield writer.writerow(columns)
+    for row in rows:
+        if columns is None:
+            columns = list(row.keys())
+            yield writer.writerow(columns)
+        yield writer.writerow([_to_csv_value(row.get(column)) for column in columns])
+    if columns is None:
+        # an empty result still gets a response body
+        yield ''
+
+
+def get_streaming_response(chunks, serialize, export_format, filename, columns=None):
+    """Return a response which streams the serialized rows in one of the `EXPORT_FORMATS`.
+
+    Args:
+        chunks (iterable): The lists of instances to serialize, usually from `iterate_in_chunks`.
+        serialize (callable): A function which takes a list of instances and returns the list of serialized rows.
+        export_format (str): The format, either 'ndjson' or 'csv'.
+        filename (str): The name of the file suggested to the client without the extension.
+        columns (list|None): The columns to include in a CSV file, taken from the first row if None.
+
+    Returns:
+        django.http.StreamingHttpResponse: The response.
+    """
+    rows = (row for chunk in chunks for row in serialize(chunk))
+    if export_format == 'csv':
+        content = stream_csv(rows, columns)
+    else:
+        content = stream_ndjson(rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_format)
+    return response
@@ -4,7 +4,12 @@ from api import views
 
 urlpatterns = [
     re_path(r'whoami', views.get_user),
+    re_path(r'^batch/?$', views.batch),
+    re_path(r'^_metrics/?$', views.metrics),
+    re_path(r'^_slow_requests/?$', views.slow_requests),
     re_path(r'^(?P<app>[a-z_]+)/(?P<model>[a-z_]+)/create/?$', views.ItemCreate.as_view()),
+    re_path(r'^(?P<app>[a-z_]+)/(?P<model>[a-z_]+)/create/bulk/?$', views.ItemBulkCreate.as_view()),
+    re_path(r'^(?P<app>[a-z_]+)/(?P<model>[a-z_]+)/update/bulk/?$', views.ItemBulkUpdate.as_view()),
     re_path(r'^(?P<app>[a-z_]+)/(?P<model>[a-z_]+)/update/(?P<pk>[0-9_a-zA-Z]+)/?$', views.ItemUpdate.as_view()),
     re_path(r'^(?P<app>[a-z_]+)/(?P<model>[a-z_]+)/delete/(?P<pk>[0-9_a-zA-Z]+)/?$', views.ItemDelete.as_view()),
     re_path(
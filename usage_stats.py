@@ -0,0 +1,145 @@
+import functools
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Field, Q
+
+from api.caching import get_cache
+from api.search_helpers import FILTER_CACHE_SIZE
+
+# the names of the lookups which can end a filter, anything else after the fields is a transform or a key
+_LOOKUP_NAMES = frozenset(Field.get_lookups())
+
+_MODELS_KEY = 'api:usage:models'
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.monotonic()
+
+
+def usage_stats_enabled():
+    """Return True if the filters and sorting used in list requests should be counted (`API_USAGE_STATS`)."""
+    return getattr(django_settings, 'API_USAGE_STATS', False)
+
+
+def _get_usage_key(label):
+    return 'api:usage:%s' % label
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def split_lookup(model, lookup):
+    """Split a filter into the path of the field it is on and the lookup it uses.
+
+    The results are cached as the fields of a model do not change while the server is running.
+
+    Args:
+        model (django.db.models.Model): The model the filter is applied to.
+        lookup (str): The filter, for example `author__name__istartswith`.
+
+    Returns:
+        tuple: The path (including any transforms or keys of the last field) and the lookup, for example
+        ('author__name', 'istartswith'). The lookup is 'exact' if the filter does not give one.
+    """
+    parts = lookup.split('__')
+    path = []
+    field = None
+    for part in parts:
+        if field is not None and (not field.is_relation or field.related_model is None):
+            break
+        try:
+            field = (field.related_model if field is not None else model)._meta.get_field(part)
+        except FieldDoesNotExist:
+            break
+        path.append(part)
+    rest = parts[len(path) :]
+    if rest and rest[-1] in _LOOKUP_NAMES:
+        return '__'.join(path + rest[:-1]), rest[-1]
+    return '__'.join(path + rest), 'exact'
+
+
+def _add_filter_lookups(model, query, lookups):
+    for child in query.children:
+        if isinstance(child, Q):
+            _add_filter_lookups(model, child, lookups)
+        elif isinstance(child, tuple):
+            lookups.add(('filter',) + split_lookup(model, child[0]))
+
+
+def record_usage(model, queries, ordering_keys):
+    """Count the filters and sorting used by a list request.
+
+    Each field and lookup in the queries is counted once for the request, as is the ordering unless it is only by
+    the id. The counts are kept by the process and added to the counts in the API cache every
+    `API_USAGE_FLUSH_INTERVAL` seconds (default 60).
+
+    Args:
+        model (django.db.models.Model): The model of the request.
+        queries (list): The Q objects used to filter and exclude items.
+        ordering_keys (list): The (field, descending) tuples from `get_ordering_keys`.
+    """
+    global _last_flush
+    usage = set()
+    for query in queries:
+        _add_filter_lookups(model, query, usage)
+    if ordering_keys != [('id', False)]:
+        usage.add(('sort', ','.join('-%s' % field if descending else field for field, descending in ordering_keys)))
+    with _lock:
+        counts = _pending.setdefault(model._meta.label_lower, {})
+        for key in usage:
+            counts[key] = counts.get(key, 0) + 1
+        flush = time.monotonic() - _last_flush >= getattr(django_settings, 'API_USAGE_FLUSH_INTERVAL', 60)
+        if flush:
+            _last_flush = time.monotonic()
+    if flush:
+        flush_usage()
+
+
+def flush_usage():
+    """Add the counts kept by this process to the counts in the API cache.
+
+    The counts are read, added to and written back so an update from another process at the same moment can be lost.
+    This is acceptable as they are only used to find the most common patterns.
+    """
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    cache = get_cache()
+    keys = {label: _get_usage_key(label) for label in pending}
+    stored = cache.get_many(list(keys.values()))
+    updated = {}
+    for label, counts in pending.items():
+        totals = stored.get(keys[label], {})
+        for key, count in counts.items():
+            totals[key] = totals.get(key, 0) + count
+        updated[keys[label]] = totals
+    cache.set_many(updated, None)
+    labels = cache.get(_MODELS_KEY, set())
+    if not labels.issuperset(pending):
+        cache.set(_MODELS_KEY, labels | set(pending), None)
+
+
+def get_usage_stats():
+    """Return the counts of the filters and sorting used for each model.
+
+    Returns:
+        dict: The counts for each model label. The keys of the counts are ('filter', path, lookup) and ('sort', keys)
+        tuples where the keys are comma separated and start with a - if they are descending.
+    """
+    flush_usage()
+    cache = get_cache()
+    labels = cache.get(_MODELS_KEY, set())
+    stored = cache.get_many([_get_usage_key(label) for label in labels])
+    return {label: stored[_get_usage_key(label)] for label in sorted(labels) if _get_usage_key(label) in stored}
+
+
+def reset_usage_stats():
+    """Remove the counts of the filters and sorting used from this process and the API cache."""
+    with _lock:
+        _pending.clear()
+    cache = get_cache()
+    labels = cache.get(_MODELS_KEY, set())
+    cache.delete_many([_get_usage_key(label) for label in labels] + [_MODELS_KEY])
@@ -1,33 +1,174 @@
 import copy
 import datetime
-import importlib
+import hashlib
+import io
 import json as jsontools
+import logging
+from contextlib import ExitStack
+from urllib.parse import urlencode
 
 from accounts.serializers import UserSerializer
-from django.apps import apps
 from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, router, transaction
+from django.db.models import Count, FileField, Max, prefetch_related_objects
 from django.db.models.deletion import ProtectedError
-from django.http import JsonResponse
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, QueryDict
+from django.urls import Resolver404, resolve
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import etag
-from rest_framework import generics, permissions, status
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework import generics, permissions, serializers, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-
+from rest_framework.serializers import raise_errors_on_nested_writes
+
+from api.caching import (
+    bump_model_generation,
+    cache_request_instance,
+    cache_response,
+    get_cached_request_instance,
+    get_cached_response,
+    get_dependent_models,
+    get_model_generations,
+    get_request_instance,
+    get_response_cache_key,
+)
 from api.decorators import apply_model_get_restrictions
-from api.search_helpers import get_field_filters
-from api.serializers import SimpleSerializer
+from api.metrics import get_prometheus_metrics, instrument, timed
+from api.models import BaseModel, VersionConflict
+from api.pagination import (
+    KeysetPaginator,
+    SelectPagePaginator,
+    get_ordering_keys,
+    has_to_many_keys,
+    order_by_keys,
+    seek_filter,
+)
+from api.query_planning import check_query_budget, count_queries, get_query_plan, query_budget_enabled
+from api.registry import get_endpoint
+from api.search_helpers import get_field_filters, get_subquery_filter
+from api.serializers import SimpleSerializer, get_values_serializer
+from api.slow_requests import get_slow_requests
+from api.streaming import EXPORT_FORMATS, get_streaming_response, iterate_in_chunks
+from api.usage_stats import record_usage, usage_stats_enabled
+
+logger = logging.getLogger(__name__)
+
+
+def _get_endpoint(kwargs):
+    """Return the endpoint for the app and model in the request or raise Http404 if there is no such model."""
+    endpoint = get_endpoint(kwargs['app'], kwargs['model'])
+    if endpoint is None:
+        raise Http404('Model does not exist')
+    return endpoint
+
+
+def _get_write_serializer_class(kwargs):
+    """Return the serializer class used for writing to the model in the request."""
+    endpoint = _get_endpoint(kwargs)
+    if endpoint.serializer_class is None:
+        raise ImproperlyConfigured('No serializer found for %s.%s' % (endpoint.app_label, endpoint.model_name))
+    return endpoint.serializer_class
 
 
 def _get_etag(request, app=None, model=None, pk=None):
+    endpoint = get_endpoint(app, model)
+    if endpoint is None:
+        return None
     try:
-        etag = str(apps.get_model(app, model).objects.get(pk=pk).version_number)
+        # the instance is kept for the rest of the request so that the update does not fetch it again
+        etag = str(get_request_instance(request, endpoint, pk).version_number)
         return etag
+    except endpoint.model.DoesNotExist:
+        return None
     except AttributeError:
         return "*"
 
 
+def _get_item_data(endpoint, instance):
+    """Return the serialized data for an instance in the same form as a request to ItemDetail.
+
+    This is used to return the current state of an instance which has just been created or updated without fetching
+    it from the database again.
+    """
+    if getattr(instance, '_prefetched_objects_cache', None):
+        # the saved data could have changed what was prefetched
+        instance._prefetched_objects_cache = {}
+    if endpoint.prefetch_keys:
+        prefetch_related_objects([instance], *endpoint.prefetch_keys)
+    serializer = endpoint.serializer_class or SimpleSerializer
+    return serializer(instance).data
+
+
+def _get_user_identifier(user):
+    """Return the value used to record the user in the created_by and last_modified_by fields."""
+    if django_settings.USER_IDENTIFIER_FIELD and (
+        hasattr(user, django_settings.USER_IDENTIFIER_FIELD)
+        and getattr(user, django_settings.USER_IDENTIFIER_FIELD) != ''
+    ):
+        return getattr(user, django_settings.USER_IDENTIFIER_FIELD)
+    return user.username
+
+
+# these are maintained by the API so the values sent back by a client do not count as changes
+_METADATA_FIELDS = ['created_time', 'created_by', 'last_modified_time', 'last_modified_by', 'version_number']
+
+
+def _has_changes(instance, validated_data):
+    """Return True if saving the validated data would change the instance.
+
+    Only the submitted fields are compared. Anything which cannot be compared reliably (nested data, files or values
+    which are not model fields) is treated as a change.
+    """
+    for name, value in validated_data.items():
+        if name in _METADATA_FIELDS:
+            continue
+        try:
+            field = instance._meta.get_field(name)
+        except Exception:
+            return True
+        if isinstance(value, dict) and field.is_relation:
+            return True
+        if field.many_to_many:
+            if not isinstance(value, (list, tuple)) or any(isinstance(item, dict) for item in value):
+                return True
+            if {item.pk for item in value} != set(getattr(instance, name).values_list('pk', flat=True)):
+                return True
+        elif field.many_to_one or field.one_to_one:
+            if (value.pk if value is not None else None) != getattr(instance, field.attname):
+                return True
+        elif field.is_relation or isinstance(field, FileField):
+            return True
+        elif value != getattr(instance, field.attname):
+            return True
+    return False
+
+
+def _etag_matches(request, etag):
+    """Return True if the If-None-Match header of the request matches the etag.
+
+    The etags sent by the API are not always quoted so the values in the header are compared with and without quotes.
+    """
+    return _etag_in_header(request.META.get('HTTP_IF_NONE_MATCH'), etag)
+
+
+def _etag_in_header(header, etag):
+    """Return True if the etag is one of the comma separated etags in an If-Match or If-None-Match value."""
+    if not header or etag is None:
+        return False
+    if header.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for value in header.split(','):
+        value = value.strip()
+        value = value[2:] if value.startswith('W/') else value
+        if value.strip('"') == etag.strip('"'):
+            return True
+    return False
+
+
 def get_user(request):
     """Return the current user profile information.
 
@@ -43,31 +184,224 @@ def get_user(request):
     return JsonResponse(serializer.data)
 
 
-class SelectPagePaginator(LimitOffsetPagination):
-    """A paginator which can select a page based on a page number (not offset)."""
+def metrics(request):
+    """Return the request metrics recorded by this server process in the Prometheus text format.
 
-    def paginate_queryset_and_get_page(self, queryset, request, view=None, index_required=None):
-        """Return the portion of the query set representing the requested page."""
-        self.limit = self.get_limit(request)
+    The metrics are only returned to staff users and to requests from the addresses in `API_METRICS_ALLOWED_IPS`
+    (which defaults to the `INTERNAL_IPS` setting).
 
-        if self.limit is None:
-            return None
+    Args:
+        request (django.http.HttpRequest): The current request.
 
-        self.offset = self.get_offset(request)
-        self.count = len(queryset)
+    Returns:
+        HttpResponse: The metrics.
+    """
+    allowed_ips = getattr(django_settings, 'API_METRICS_ALLOWED_IPS', getattr(django_settings, 'INTERNAL_IPS', []))
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return JsonResponse({'message': "Permission required"}, status=403)
+    return HttpResponse(get_prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        if index_required is not None:
-            page = int(index_required / self.limit)
-            self.offset = page * self.limit
 
-        self.request = request
-        if self.count > self.limit and self.template is not None:
-            self.display_page_controls = True
+def slow_requests(request):
+    """Return the slow requests recorded by this server process, the most recent first.
+
+    The records include the SQL and parameters of the queries so they are only returned to superusers.
+
+    Args:
+        request (django.http.HttpRequest): The current request.
+
+    Returns:
+        JsonResponse: The slow requests.
+    """
+    if not request.user.is_superuser:
+        return JsonResponse({'message': "Permission required"}, status=403)
+    records = get_slow_requests()
+    return JsonResponse({'count': len(records), 'results': records})
+
+
+_BATCH_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+
+
+def _get_batch_request(request, method, path, query, body, headers):
+    """Return a copy of the batch request for one of the requests it contains."""
+    sub_request = HttpRequest()
+    sub_request.method = method
+    sub_request.path_info = path
+    sub_request.path = request.META.get('SCRIPT_NAME', '').rstrip('/') + path
+    # the scheme is used in absolute links and the csrf origin check so it must match the batch request
+    sub_request._get_scheme = request._get_scheme
+    sub_request.META = {
+        key: value
+        for key, value in request.META.items()
+        if not key.startswith('HTTP_IF_') and key not in ['CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING']
+    }
+    if isinstance(query, dict):
+        query = urlencode(query, doseq=True)
+    sub_request.META['QUERY_STRING'] = query or ''
+    sub_request.META['REQUEST_METHOD'] = method
+    sub_request.GET = QueryDict(query or '')
+    for header, value in (headers or {}).items():
+        sub_request.META['HTTP_%s' % header.upper().replace('-', '_')] = str(value)
+    content = b''
+    if body is not None:
+        content = jsontools.dumps(body).encode('utf-8')
+        sub_request.META['CONTENT_TYPE'] = 'application/json'
+    sub_request.META['CONTENT_LENGTH'] = str(len(content))
+    sub_request._stream = io.BytesIO(content)
+    sub_request._read_started = False
+    sub_request.COOKIES = request.COOKIES
+    # sharing the user and session means they are only loaded once for the whole batch
+    for attribute in ['user', 'session', 'auth']:
+        if hasattr(request, attribute):
+            setattr(sub_request, attribute, getattr(request, attribute))
+    sub_request._dont_enforce_csrf_checks = getattr(request, '_dont_enforce_csrf_checks', False)
+    return sub_request
+
+
+def _get_batch_result(response):
+    """Return the status, headers and body of the response to a request in a batch."""
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    result = {'status': response.status_code, 'headers': {}}
+    for header in ['etag', 'location', 'content-type']:
+        if response.has_header(header):
+            result['headers'][header] = response[header]
+    body = content.decode(response.charset or 'utf-8')
+    if body and response.get('content-type', '').startswith('application/json'):
+        body = jsontools.loads(body)
+    result['body'] = body if body != '' else None
+    return result
+
+
+@instrument('batch')
+def batch(request):
+    """Run a list of API requests and return all of the responses together.
+
+    The body of the request is a JSON object with a list of `requests` and the optional boolean options `atomic` and
+    `consistent` (or just the list of requests). Each request has a `method`, a `path` relative to the API (for example
+    `cits/work/1`) and optionally a `query` (a string or an object), a JSON `body` and a `headers` object. The requests
+    are run in order through the normal API views with the user of the batch request.
+
+    If `atomic` is true all of the requests are run in a single transaction and if any request fails the transaction
+    is rolled back and the rest of the requests are not run. If `consistent` is true all of the requests read from
+    the same snapshot of the database.
+
+    Args:
+        request (django.http.HttpRequest): The current request.
+
+    Returns:
+        JSONResponse: A `results` list containing the status, headers and body of the response to each request.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'message': "Method not allowed"}, status=405)
+    try:
+        data = jsontools.loads(request.body)
+    except ValueError:
+        return JsonResponse({'message': "The request body must be valid JSON"}, status=400)
+    if isinstance(data, list):
+        data = {'requests': data}
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        return JsonResponse({'message': "A list of requests is required"}, status=400)
+    max_requests = getattr(django_settings, 'API_BATCH_MAX_REQUESTS', 50)
+    if len(data['requests']) > max_requests:
+        return JsonResponse({'message': "No more than %s requests can be sent in one batch" % max_requests}, status=400)
+
+    # the paths in the batch are relative to the API which is where this view is mounted
+    api_root = request.path_info[: request.path_info.rstrip('/').rfind('/') + 1]
+    atomic = data.get('atomic', False) is True
+    consistent = data.get('consistent', False) is True
+    results = []
+    failed = None
+    with ExitStack() as stack:
+        if atomic or consistent:
+            connection = connections[router.db_for_read(BaseModel)]
+            new_transaction = not connection.in_atomic_block
+            stack.enter_context(transaction.atomic(using=connection.alias))
+            if consistent and new_transaction and connection.vendor == 'postgresql':
+                # this must be the first statement in the transaction
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        for index, sub_request_data in enumerate(data['requests']):
+            result = _run_batch_request(request, api_root, sub_request_data)
+            results.append(result)
+            if atomic and result['status'] >= 400:
+                failed = index
+                transaction.set_rollback(True, using=connection.alias)
+                break
+
+    if failed is not None:
+        return JsonResponse(
+            {'message': "No changes were saved because request %s failed" % failed, 'results': results},
+            status=results[failed]['status'],
+        )
+    return JsonResponse({'results': results})
+
+
+def _run_batch_request(request, api_root, data):
+    """Run a single request from a batch and return the result."""
+    if not isinstance(data, dict):
+        return {'status': 400, 'headers': {}, 'body': {'message': "Each request must be an object"}}
+    method = str(data.get('method', 'GET')).upper()
+    if method not in _BATCH_METHODS:
+        return {'status': 405, 'headers': {}, 'body': {'message': "Method not allowed"}}
+    path = str(data.get('path', ''))
+    script_root = request.META.get('SCRIPT_NAME', '').rstrip('/') + api_root
+    for root in [script_root, api_root]:
+        if path.startswith(root):
+            path = path[len(root) :]
+            break
+    path, _, query = path.lstrip('/').partition('?')
+    try:
+        match = resolve('/' + path, urlconf='api.urls')
+    except Resolver404:
+        return {'status': 404, 'headers': {}, 'body': {'message': "Not found"}}
+    if match.func is batch:
+        return {'status': 400, 'headers': {}, 'body': {'message': "Batches cannot be nested"}}
+    query = data.get('query', query)
+    sub_request = _get_batch_request(request, method, api_root + path, query, data.get('body'), data.get('headers'))
+    sub_request.resolver_match = match
+    connection = connections[router.db_for_read(BaseModel)]
+    try:
+        with ExitStack() as stack:
+            if connection.in_atomic_block:
+                # a savepoint keeps the transaction of the batch usable if the request fails
+                stack.enter_context(transaction.atomic(using=connection.alias))
+            return _get_batch_result(match.func(sub_request, *match.args, **match.kwargs))
+    except Exception:
+        logger.exception('Batched request %s %s failed', method, sub_request.path)
+        return {'status': 500, 'headers': {}, 'body': {'message': "The request failed with an internal error"}}
+
 
-        if self.count == 0 or self.offset > self.count:
-            return []
+class RequestInstanceMixin:
+    """Reuse the model instance already loaded for this request rather than fetching it again.
 
-        return (list(queryset[self.offset : self.offset + self.limit]), self.offset)
+    The instance is loaded when the request is checked by apply_model_get_restrictions or the etag decorator. If
+    the request has a supplied_filter it is still applied to check the instance can be seen.
+    """
+
+    def get_object(self):
+        """Return the object the view is displaying."""
+        if getattr(self, '_object', None) is not None:
+            return self._object
+        endpoint = _get_endpoint(self.kwargs)
+        instance = get_cached_request_instance(self.request, endpoint.model, self.kwargs['pk'])
+        if instance is None:
+            instance = super().get_object()
+            cache_request_instance(self.request, instance)
+        else:
+            supplied_filter = self.kwargs.get('supplied_filter')
+            if (
+                supplied_filter is not None
+                and not endpoint.model.objects.filter(supplied_filter, pk=instance.pk).exists()
+            ):
+                raise Http404('No %s matches the given query.' % endpoint.model._meta.object_name)
+            self.check_object_permissions(self.request, instance)
+        self._object = instance
+        return instance
 
 
 """
@@ -79,23 +413,118 @@ I have tried to specify things in the model itself and then call them from here
 """
 
 
+class ResponseCacheMixin:
+    """Share the responses to requests which return the same data to everyone who makes them.
+
+    Only GET requests for models which are public, or which are public_or_* and are requested anonymously, are
+    cached. The cached responses are invalidated by the generation of the model and its related models.
+    """
+
+    def get_response_cache_key(self, request):
+        """Return the key to cache the response to the request with or None if it cannot be shared."""
+        if not getattr(django_settings, 'API_RESPONSE_CACHE_TIMEOUT', 0):
+            return None
+        if request.method != 'GET' or '_format' in request.GET:
+            return None
+        endpoint = _get_endpoint(self.kwargs)
+        if endpoint.availability == 'public':
+            visibility = 'public'
+        elif endpoint.availability in ['public_or_project', 'public_or_user'] and not request.user.is_authenticated:
+            visibility = 'anonymous'
+        else:
+            return None
+        return get_response_cache_key(request, endpoint.model, visibility)
+
+    def get_cached_response(self, request, key):
+        """Return the cached response for the key or None if there isn't one."""
+        if key is None:
+            return None
+        cached = get_cached_response(key)
+        if cached is None:
+            return None
+        data, etag = cached
+        if _etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'etag': etag})
+        response = Response(data, headers={'X-Cache': 'HIT'})
+        if etag is not None:
+            response['etag'] = etag
+        return response
+
+    def cache_response(self, key, response):
+        """Cache the response if it can be shared."""
+        if key is not None and response.status_code == status.HTTP_200_OK:
+            cache_response(key, response.data, response.get('etag'))
+            response['X-Cache'] = 'MISS'
+        return response
+
+
+def _get_item_count(response):
+    """Return the number of items in the data of a response."""
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return len(data['results'])
+    if isinstance(data, list):
+        return len(data)
+    return 1 if data else 0
+
+
+class QueryBudgetMixin:
+    """Warn when a request runs more queries than its budget for the number of items it returns.
+
+    The queries are only counted if `API_QUERY_BUDGET_WARNINGS` is True (the default is the DEBUG setting). This is
+    intended to catch serializers which run queries for each item that the query planning has not been able to avoid.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        """Run the request, counting the queries if the budget is being checked."""
+        if not query_budget_enabled():
+            return super().dispatch(request, *args, **kwargs)
+        with count_queries() as counter:
+            response = super().dispatch(request, *args, **kwargs)
+        description = '%s %s' % (request.method, request.get_full_path())
+        check_query_budget(description, counter.count, _get_item_count(response))
+        return response
+
+
+@method_decorator(instrument('list'), name='dispatch')
 @method_decorator(apply_model_get_restrictions, name='dispatch')
-class ItemList(generics.ListAPIView):
+class ItemList(QueryBudgetMixin, ResponseCacheMixin, generics.ListAPIView):
     """Concrete view for listing a queryset."""
 
     permission_classes = (permissions.AllowAny,)
     renderer_classes = (JSONRenderer,)
     pagination_class = SelectPagePaginator
+    keyset_pagination_class = KeysetPaginator
+
+    @property
+    def paginator(self):
+        """Return the paginator instance for the view.
+
+        Keyset (cursor) pagination is used if a `_cursor` is supplied in the request or if the model sets `PAGINATION`
+        to 'keyset' and the request does not ask for an offset.
+        """
+        if not hasattr(self, '_paginator'):
+            if self._use_keyset_pagination():
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def _use_keyset_pagination(self):
+        # an offset or _show needs the offset paginator even if a cursor is also given
+        if 'offset' in self.request.GET or '_show' in self.request.GET:
+            return False
+        if '_cursor' in self.request.GET:
+            return True
+        model = _get_endpoint(self.kwargs).model
+        if getattr(model, 'PAGINATION', None) != 'keyset':
+            return False
+        # a sorting on a to-many relation can't be paged with a cursor so falls back to offsets
+        return not has_to_many_keys(model, get_ordering_keys(model, self.request.GET.get('_sort')))
 
     def get_serializer_class(self):
         """Return the class to use for the serializer."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        try:
-            serializer_name = target.SERIALIZER
-            serializer = getattr(importlib.import_module('%s.serializers' % self.kwargs['app']), serializer_name)
-        except Exception:
-            serializer = SimpleSerializer
-        return serializer
+        return _get_endpoint(self.kwargs).serializer_class or SimpleSerializer
 
     def get_serializer(self, *args, **kwargs):
         """Return the serializer instance that should be used for validating and de/serializing input and output."""
@@ -106,42 +535,62 @@ class ItemList(generics.ListAPIView):
 
     def get_queryset(self, fields=None):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        try:
-            related_keys = target.RELATED_KEYS
-        except AttributeError:
-            related_keys = [None]
-        # we only need to use select_related here (and not use prefetch_related) as the lists
-        # only show data from a single model and its Foreign keys
-
-        hits = target.objects.all().select_related(*related_keys)
-
-        if 'supplied_filter' in self.kwargs and self.kwargs['supplied_filter'] is not None:
-            hits = hits.filter(self.kwargs['supplied_filter'])
-
-        requestQuery = dict(self.request.GET)
-
-        filter_queries = get_field_filters(requestQuery, target, 'filter')
-        exclude_queries = get_field_filters(requestQuery, target, 'exclude')
-        hits = hits.exclude(exclude_queries[0]).filter(filter_queries[0]).distinct()
-        if len(filter_queries) > 1:
-            for query in filter_queries[1:]:
-                hits = hits.filter(query)
-        if len(exclude_queries) > 1:
-            for query in exclude_queries[1:]:
-                hits = hits.exclude(query)
-
+        endpoint = _get_endpoint(self.kwargs)
+        target = endpoint.model
         # override fields if required - only used for internal calls from other apps
         if fields:
             self.kwargs['fields'] = fields.split(',')
         elif '_fields' in self.request.GET:
             self.kwargs['fields'] = self.request.GET.get('_fields').split(',')
-        # sort them if needed
-        if '_sort' in self.request.GET:
-            sort_by = self.request.GET.get('_sort').split(',')
-            hits = hits.order_by(*sort_by)
+
+        ordering_keys = get_ordering_keys(target, self.request.GET.get('_sort'))
+        hits = target.objects.all()
+        plan = self.get_query_plan()
+        if plan is not None:
+            # only the columns and relations the serializer needs for the fields (and the sorting) are read
+            hits = plan.apply(hits, [field.split('__')[0] for field, descending in ordering_keys])
+        elif endpoint.related_keys:
+            hits = hits.select_related(*endpoint.related_keys)
+
+        requestQuery = dict(self.request.GET)
+
+        with timed(self.request, 'filters'):
+            filter_queries = get_field_filters(requestQuery, target, 'filter')
+            exclude_queries = get_field_filters(requestQuery, target, 'exclude')
+            # only the filters from the query string are counted, not the restrictions of the availability
+            client_queries = filter_queries + exclude_queries
+            if 'supplied_filter' in self.kwargs and self.kwargs['supplied_filter'] is not None:
+                filter_queries = [self.kwargs['supplied_filter']] + filter_queries
+            # to-many relations are filtered with EXISTS subqueries so the rows are only made distinct if a filter or
+            # the sorting still has to join one (exclude always uses subqueries for these)
+            needs_distinct = False
+            hits = hits.exclude(exclude_queries[0])
+            for query in filter_queries:
+                query, joins_to_many = get_subquery_filter(target, query)
+                hits = hits.filter(query)
+                needs_distinct = needs_distinct or joins_to_many
+            if len(exclude_queries) > 1:
+                for query in exclude_queries[1:]:
+                    hits = hits.exclude(query)
+        if usage_stats_enabled():
+            # the filters and sorting clients use are counted so the indexes they need can be recommended
+            record_usage(target, client_queries, ordering_keys)
+
+        # sort them, always finishing with the id so that the order (and therefore each page) is stable
+        if needs_distinct or has_to_many_keys(target, ordering_keys):
+            hits = hits.distinct()
+        hits = order_by_keys(hits, ordering_keys)
         return hits
 
+    def get_query_plan(self):
+        """Return the plan of the columns and relations needed to serialize the requested fields.
+
+        Returns:
+            api.query_planning.QueryPlan|None: The plan or None if the serializer can't be planned.
+        """
+        fields = tuple(self.kwargs['fields']) if self.kwargs.get('fields') else None
+        return get_query_plan(_get_endpoint(self.kwargs), self.get_serializer_class(), fields)
+
     def get(self, request, app, model, supplied_filter=None):
         """Return the items.
 
@@ -149,13 +598,120 @@ class ItemList(generics.ListAPIView):
         """
         return self.list(request)
 
+    def list(self, request, *args, **kwargs):
+        """Return the page of items with a collection etag, or a 304 response if the client already has it.
+
+        This overrides the function provided by the drf ListModelMixin to add the etag.
+        """
+        cache_key = self.get_response_cache_key(request)
+        cached_response = self.get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if request.GET.get('_format') in EXPORT_FORMATS:
+            return self.get_streaming_response(queryset, request.GET.get('_format'))
+        etag = self._get_collection_etag(queryset)
+        if _etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'etag': etag})
+
+        values_serializer = self.get_values_serializer()
+        if values_serializer is not None:
+            # the rows are read and serialized without making model instances
+            queryset = self.get_values_queryset(queryset, values_serializer)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.serialize(page, values_serializer))
+        else:
+            response = Response(self.serialize(queryset, values_serializer))
+        if etag is not None:
+            response['etag'] = etag
+        return self.cache_response(cache_key, response)
+
+    def get_values_serializer(self):
+        """Return a ValuesSerializer if every field requested in `_fields` can be serialized directly from a column.
+
+        Returns:
+            api.serializers.ValuesSerializer|None: The serializer or None if the items must be serialized as instances.
+        """
+        if not self.kwargs.get('fields') or not getattr(django_settings, 'API_VALUES_SERIALIZATION', True):
+            return None
+        endpoint = _get_endpoint(self.kwargs)
+        return get_values_serializer(self.get_serializer_class(), endpoint.model, tuple(self.kwargs['fields']))
+
+    def get_values_queryset(self, queryset, values_serializer):
+        """Return the queryset as a values queryset with the columns needed to serialize and paginate the items."""
+        columns = list(values_serializer.columns)
+        for field, descending in get_ordering_keys(queryset.model, self.request.GET.get('_sort')):
+            if field not in columns:
+                columns.append(field)
+        return queryset.prefetch_related(None).values(*columns)
+
+    def serialize(self, items, values_serializer=None):
+        """Return the serialized data for a list of items."""
+        with timed(self.request, 'serialize'):
+            if values_serializer is not None:
+                return [values_serializer.to_representation(row) for row in items]
+            return self.get_serializer(items, many=True).data
+
+    def get_streaming_response(self, queryset, export_format):
+        """Return a response which streams every item in the queryset in the export format without pagination.
+
+        The queryset is read and serialized in chunks so the memory used does not depend on the number of items.
+        """
+        endpoint = _get_endpoint(self.kwargs)
+        values_serializer = self.get_values_serializer()
+        if values_serializer is not None:
+            chunks = iterate_in_chunks(self.get_values_queryset(queryset, values_serializer))
+        else:
+            plan = self.get_query_plan()
+            prefetch_keys = plan.get_prefetch_lookups() if plan is not None else endpoint.prefetch_keys
+            # each chunk is prefetched separately as iterator() doesn't prefetch in all the supported Django versions
+            chunks = iterate_in_chunks(queryset.prefetch_related(None), prefetch_keys=prefetch_keys)
+
+        def serialize(chunk):
+            return self.serialize(chunk, values_serializer)
+
+        return get_streaming_response(
+            chunks, serialize, export_format, endpoint.model_name, columns=self.kwargs.get('fields')
+        )
+
+    def _get_collection_etag(self, queryset):
+        """Return a weak etag for the list which changes whenever any of the items in it change.
+
+        It is built from the number of items, their highest version number and latest modification time, the cache
+        generations of the model and its related models and the query of the request. The etags are only made if the
+        `API_COLLECTION_ETAGS` setting is True and the list is counted exactly, as the summary needs a scan of all of
+        the items which the other count strategies and keyset pagination avoid.
+        """
+        if not getattr(django_settings, 'API_COLLECTION_ETAGS', False):
+            return None
+        if self._use_keyset_pagination() or self.paginator.get_count_strategy(queryset, self.request) != 'exact':
+            return None
+        fields = [field.name for field in queryset.model._meta.concrete_fields]
+        if 'version_number' not in fields or 'last_modified_time' not in fields:
+            return None
+        summary = queryset.order_by().aggregate(
+            count=Count('id'), version=Max('version_number'), modified=Max('last_modified_time')
+        )
+        generations = get_model_generations(get_dependent_models(queryset.model))
+        query = urlencode(sorted(self.request.GET.lists()), doseq=True)
+        data = repr((summary['count'], summary['version'], summary['modified'], generations, self.request.path, query))
+        return 'W/"%s"' % hashlib.md5(data.encode('utf-8')).hexdigest()
+
     def _get_offset_required(self, queryset, item_id):
-        """Get the offset required so the item with `item_id` is on the page returned."""
+        """Get the offset required so the item with `item_id` is on the page returned.
+
+        The position is found in the database by counting the rows which come before the item in the ordering.
+        """
+        keys = get_ordering_keys(queryset.model, self.request.GET.get('_sort'))
         try:
-            item_position = list(queryset.values_list('id', flat=True)).index(int(item_id))
-        except Exception:
-            item_position = 0
-        return item_position
+            values = queryset.filter(pk=item_id).values_list(*[field for field, descending in keys]).first()
+        except (ValueError, TypeError):
+            values = None
+        if values is None:
+            return 0
+        return queryset.filter(seek_filter(keys, values, forward=False)).count()
 
     def paginate_queryset_and_get_page(self, queryset, index_required=None):
         """Return a single page of results, or `None` if pagination is disabled."""
@@ -183,6 +739,9 @@ class ItemList(generics.ListAPIView):
             queryset = self.get_queryset()
 
         offset = None
+        if '_cursor' not in request.GET or not self._use_keyset_pagination():
+            # the html interface relies on the count and offset so only uses keyset pagination if asked to
+            self._paginator = self.pagination_class()
         if '_show' in request.GET:
             index = self._get_offset_required(queryset, request.GET.get('_show'))
             (paginated_query_set, offset) = self.paginate_queryset_and_get_page(queryset, index_required=index)
@@ -209,8 +768,9 @@ class PrivateItemList(ItemList):
         return self.list(request)
 
 
+@method_decorator(instrument('detail'), name='dispatch')
 @method_decorator(apply_model_get_restrictions, name='dispatch')
-class ItemDetail(generics.RetrieveAPIView):
+class ItemDetail(QueryBudgetMixin, RequestInstanceMixin, ResponseCacheMixin, generics.RetrieveAPIView):
     """Concrete view for retrieving a model instance."""
 
     permission_classes = (permissions.AllowAny,)
@@ -218,29 +778,53 @@ class ItemDetail(generics.RetrieveAPIView):
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        try:
-            prefetch_keys = target.PREFETCH_KEYS
-        except Exception:
-            prefetch_keys = [None]
-        try:
-            related_keys = target.RELATED_KEYS
-        except Exception:
-            related_keys = [None]
-        hits = target.objects.all().select_related(*related_keys).prefetch_related(*prefetch_keys)
+        endpoint = _get_endpoint(self.kwargs)
+        hits = endpoint.model.objects.all()
+        related_keys, prefetch_keys = self.get_relation_keys()
+        if related_keys:
+            hits = hits.select_related(*related_keys)
+        if prefetch_keys:
+            hits = hits.prefetch_related(*prefetch_keys)
         if 'supplied_filter' in self.kwargs and self.kwargs['supplied_filter'] is not None:
-            hits = hits.filter(self.kwargs['supplied_filter']).distinct()
+            query, joins_to_many = get_subquery_filter(endpoint.model, self.kwargs['supplied_filter'])
+            hits = hits.filter(query)
+            if joins_to_many:
+                hits = hits.distinct()
         return hits
 
     def get_serializer_class(self):
         """Return the class to use for the serializer."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        try:
-            serializer_name = target.SERIALIZER
-            serializer = getattr(importlib.import_module('%s.serializers' % self.kwargs['app']), serializer_name)
-        except Exception:
-            serializer = SimpleSerializer
-        return serializer
+        return _get_endpoint(self.kwargs).serializer_class or SimpleSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        """Return the serializer instance, limited to the fields requested in `_fields` if there are any."""
+        fields = self.get_requested_fields()
+        if fields:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get_requested_fields(self):
+        """Return the list of fields requested in `_fields` or None if all of them are wanted."""
+        request = getattr(self, 'request', None)
+        if request is None or not request.GET.get('_fields'):
+            return None
+        return request.GET.get('_fields').split(',')
+
+    def get_relation_keys(self):
+        """Return the relations to select and prefetch for the item.
+
+        Only the relations the serializer uses for the requested fields are loaded. All of the columns of the item are
+        always loaded as the instance is shared with the availability and etag checks of the request.
+
+        Returns:
+            tuple: The list of relations to load with select_related and the list of lookups for prefetch_related.
+        """
+        endpoint = _get_endpoint(self.kwargs)
+        fields = self.get_requested_fields()
+        plan = get_query_plan(endpoint, self.get_serializer_class(), tuple(fields) if fields else None)
+        if plan is None:
+            return endpoint.related_keys, endpoint.prefetch_keys
+        return plan.related_keys, plan.get_prefetch_lookups()
 
     def retrieve(self, request, *args, **kwargs):
         """Retrieve a model instance and set etag header in response.
@@ -248,18 +832,34 @@ class ItemDetail(generics.RetrieveAPIView):
         This overrides the function provided by the drf RetrieveModelMixin to setthe etag header in the response.
         """
         instance = self.get_object()
+        related_keys, prefetch_keys = self.get_relation_keys()
+        if prefetch_keys:
+            # this does nothing if the instance was fetched with the queryset which already prefetches them
+            prefetch_related_objects([instance], *prefetch_keys)
         serializer = self.get_serializer(instance)
+        with timed(request, 'serialize'):
+            data = serializer.data
         try:
-            return Response(serializer.data, headers={'etag': '%d' % instance.version_number})
+            return Response(data, headers={'etag': '%d' % instance.version_number})
         except (AttributeError, TypeError):
-            return Response(serializer.data)
+            return Response(data)
 
     def get(self, request, app, model, pk, supplied_filter=None):
         """Return the item.
 
-        This one is used by the regular api calls.
+        This one is used by the regular api calls. If the If-None-Match header of the request matches the current
+        version of the item a 304 response is returned without serializing it.
         """
-        return self.retrieve(request)
+        cache_key = self.get_response_cache_key(request)
+        cached_response = self.get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+
+        if request.META.get('HTTP_IF_NONE_MATCH') and hasattr(_get_endpoint(self.kwargs).model, 'version_number'):
+            version_number = self.get_object().version_number
+            if version_number is not None and _etag_matches(request, '%d' % version_number):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'etag': '%d' % version_number})
+        return self.cache_response(cache_key, self.retrieve(request))
 
     # If you do also need post here then this will work - it is disabled now until we need it
     #     def post(self, request, app, model, pk):
@@ -293,24 +893,21 @@ class PrivateItemDetail(ItemDetail):
     permission_classes = (permissions.DjangoModelPermissions,)
 
 
+@method_decorator(instrument('update'), name='dispatch')
 @method_decorator(etag(_get_etag), name='dispatch')
-class ItemUpdate(generics.UpdateAPIView):
+class ItemUpdate(RequestInstanceMixin, generics.UpdateAPIView):
     """Concrete view for updating a model instance."""
 
     permission_classes = (permissions.DjangoModelPermissions,)
 
     def get_serializer_class(self):
         """Return the class to use for the serializer."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        serializer_name = target.SERIALIZER
-        serializer = getattr(importlib.import_module('%s.serializers' % self.kwargs['app']), serializer_name)
-        return serializer
+        return _get_write_serializer_class(self.kwargs)
 
     def get_serializer(self, *args, **kwargs):
         """Return the serializer instance that should be used for validating and de/serializing input and output."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
         serializer_class = self.get_serializer_class()
-        fields = copy.deepcopy(target.REQUIRED_FIELDS)
+        fields = copy.deepcopy(_get_endpoint(self.kwargs).required_fields)
         for key in self.request.data:
             if key not in fields:
                 fields.append(key)
@@ -319,8 +916,7 @@ class ItemUpdate(generics.UpdateAPIView):
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        return target.objects.all()
+        return _get_endpoint(self.kwargs).model.objects.all()
 
     def update(self, request, *args, **kwargs):
         """Update the item."""
@@ -328,45 +924,34 @@ class ItemUpdate(generics.UpdateAPIView):
 
         instance = self.get_object()
         data = request.data
-        if not partial:
-            new = jsontools.dumps(copy.deepcopy(data), sort_keys=True)
-            # check to see if the currently stored version is different from this one
-            # and only if it is changed the last modified by time and user
-            item = self.get_queryset().get(pk=data['id'])
-            serializer = self.get_serializer_class()
-            json = serializer(item).data
-            current = jsontools.dumps(json, sort_keys=True)
-            if current != new:
-                data['last_modified_time'] = datetime.datetime.now()
-                if django_settings.USER_IDENTIFIER_FIELD and (
-                    hasattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-                    and getattr(request.user, django_settings.USER_IDENTIFIER_FIELD) != ''
-                ):
-                    data['last_modified_by'] = getattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-                else:
-                    data['last_modified_by'] = request.user.username
-        else:
+        if partial:
             data['last_modified_time'] = datetime.datetime.now()
-            if django_settings.USER_IDENTIFIER_FIELD and (
-                hasattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-                and getattr(request.user, django_settings.USER_IDENTIFIER_FIELD) != ''
-            ):
-                data['last_modified_by'] = getattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-            else:
-                data['last_modified_by'] = request.user.username
+            data['last_modified_by'] = _get_user_identifier(request.user)
 
         serializer = self.get_serializer(instance, data=data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-
-        if getattr(instance, '_prefetched_objects_cache', None):
-            # If 'prefetch_related' has been applied to a queryset, we need to
-            # refresh the instance from the database.
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
+        modified = {}
+        if not partial:
+            # a full document which matches what is stored is not saved so the version and etag stay the same
+            if _has_changes(instance, serializer.validated_data):
+                modified = {
+                    'last_modified_time': datetime.datetime.now(),
+                    'last_modified_by': _get_user_identifier(request.user),
+                }
+        if partial or modified:
+            # the save only goes ahead if nobody else has saved the item since it was loaded for this request
+            if isinstance(instance, BaseModel):
+                instance.set_expected_version(instance.version_number)
+            try:
+                self.perform_update(serializer, **modified)
+            except VersionConflict:
+                return Response(
+                    {'message': "The item has been changed since it was retrieved"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
 
         # return the full updated object
-        updated_instance = ItemDetail().get_item(request, **kwargs)
+        updated_instance = _get_item_data(_get_endpoint(self.kwargs), instance)
 
         try:
             # return Response(serializer(updated_instance).data,
@@ -376,7 +961,12 @@ class ItemUpdate(generics.UpdateAPIView):
             # return Response(serializer(updated_instance).data)
             return Response(updated_instance)
 
+    def perform_update(self, serializer, **kwargs):
+        """Save the instance, adding any keyword arguments to the validated data."""
+        serializer.save(**kwargs)
+
 
+@method_decorator(instrument('create'), name='dispatch')
 class ItemCreate(generics.CreateAPIView):
     """Concrete view for creating a model instance."""
 
@@ -384,16 +974,12 @@ class ItemCreate(generics.CreateAPIView):
 
     def get_serializer_class(self):
         """Return the class to use for the serializer."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        serializer_name = target.SERIALIZER
-        serializer = getattr(importlib.import_module('%s.serializers' % self.kwargs['app']), serializer_name)
-        return serializer
+        return _get_write_serializer_class(self.kwargs)
 
     def get_serializer(self, *args, **kwargs):
         """Return the serializer instance that should be used for validating and de/serializing input and output."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
         serializer_class = self.get_serializer_class()
-        fields = copy.deepcopy(target.REQUIRED_FIELDS)
+        fields = copy.deepcopy(_get_endpoint(self.kwargs).required_fields)
         for key in self.request.data:
             if key not in fields:
                 fields.append(key)
@@ -402,26 +988,18 @@ class ItemCreate(generics.CreateAPIView):
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        return target.objects.all()
+        return _get_endpoint(self.kwargs).model.objects.all()
 
     def create(self, request, *args, **kwargs):
         """Create an item."""
         self.kwargs = kwargs
         data = request.data
         data['created_time'] = datetime.datetime.now()
-        if django_settings.USER_IDENTIFIER_FIELD and (
-            hasattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-            and getattr(request.user, django_settings.USER_IDENTIFIER_FIELD) != ''
-        ):
-            data['created_by'] = getattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-        else:
-            data['created_by'] = request.user.username
+        data['created_by'] = _get_user_identifier(request.user)
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
         new_instance = self.perform_create(serializer)
-        instance_id = new_instance.id
-        created_instance = ItemDetail().get_item(request, pk=instance_id, **kwargs)
+        created_instance = _get_item_data(_get_endpoint(self.kwargs), new_instance)
         headers = self.get_success_headers(serializer.data)
         try:
             headers['etag'] = '%s' % created_instance['version_number']
@@ -435,15 +1013,235 @@ class ItemCreate(generics.CreateAPIView):
         return instance
 
 
-class ItemDelete(generics.DestroyAPIView):
+def _get_bulk_items(request):
+    """Return the list of items in the body of a bulk request or raise ValidationError if it is not a usable list."""
+    items = request.data
+    if not isinstance(items, list):
+        raise ValidationError({'message': 'A list of items is required'})
+    max_items = getattr(django_settings, 'API_BULK_MAX_ITEMS', 1000)
+    if len(items) > max_items:
+        raise ValidationError({'message': 'No more than %s items can be sent in one request' % max_items})
+    return items
+
+
+def _get_bulk_fields(endpoint, items, exclude=()):
+    """Return the fields needed by the serializer to validate all of the items in a bulk request."""
+    fields = copy.deepcopy(endpoint.required_fields)
+    for item in items:
+        if isinstance(item, dict):
+            for key in item:
+                if key not in fields and key not in exclude:
+                    fields.append(key)
+    return fields
+
+
+def _get_bulk_results(endpoint, instances, status_code):
+    """Return the result of each instance in a bulk request with the same data and etag as a single request."""
+    if endpoint.prefetch_keys:
+        prefetch_related_objects(instances, *endpoint.prefetch_keys)
+    serializer = endpoint.serializer_class or SimpleSerializer
+    results = []
+    for instance in instances:
+        data = serializer(instance).data
+        results.append({'status': status_code, 'etag': '%s' % getattr(instance, 'version_number', ''), 'data': data})
+    return results
+
+
+@method_decorator(instrument('bulk_create'), name='dispatch')
+class ItemBulkCreate(generics.CreateAPIView):
+    """Concrete view for creating a list of model instances in a single transaction.
+
+    The whole list is validated before anything is saved and either all of the items are created or none of them are.
+    When the serializer uses the default create method the items are inserted with `bulk_create`.
+    """
+
+    permission_classes = (permissions.DjangoModelPermissions,)
+
+    def get_serializer_class(self):
+        """Return the class to use for the serializer."""
+        return _get_write_serializer_class(self.kwargs)
+
+    def get_queryset(self):
+        """Get the list of items for this view."""
+        return _get_endpoint(self.kwargs).model.objects.all()
+
+    def create(self, request, *args, **kwargs):
+        """Create the items."""
+        endpoint = _get_endpoint(self.kwargs)
+        items = _get_bulk_items(request)
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(data=items, fields=_get_bulk_fields(endpoint, items), many=True)
+        if not serializer.is_valid():
+            return Response(
+                {'message': 'The items are not valid', 'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        created = {'created_time': datetime.datetime.now(), 'created_by': _get_user_identifier(request.user)}
+        if issubclass(endpoint.model, BaseModel):
+            created['version_number'] = 1
+        with transaction.atomic(using=router.db_for_write(endpoint.model)):
+            if serializer_class.create is serializers.ModelSerializer.create:
+                instances = self.perform_bulk_create(endpoint.model, serializer, created)
+            else:
+                # the serializer has its own way of creating instances so it must be used for each one
+                instances = [serializer.child.create({**data, **created}) for data in serializer.validated_data]
+        return Response(_get_bulk_results(endpoint, instances, status.HTTP_201_CREATED), status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, model, serializer, created):
+        """Insert the validated items with as few queries as possible and return the new instances."""
+        instances = []
+        many_to_many = []
+        for data in serializer.validated_data:
+            raise_errors_on_nested_writes('create', serializer.child, data)
+            data = {**data, **created}
+            relations = {}
+            for field in model._meta.many_to_many:
+                if field.name in data:
+                    relations[field] = data.pop(field.name)
+            instances.append(model(**data))
+            many_to_many.append(relations)
+
+        connection = connections[router.db_for_write(model)]
+        if connection.features.can_return_rows_from_bulk_insert:
+            model.objects.bulk_create(instances)
+            # bulk_create does not send post_save so anything cached for the model must be invalidated here
+            bump_model_generation(model)
+        else:
+            # the primary keys are needed to add the many-to-many relations and tell the client what was created
+            for instance in instances:
+                instance.save(force_insert=True)
+
+        through_rows = {}
+        for instance, relations in zip(instances, many_to_many):
+            for field, values in relations.items():
+                through = field.remote_field.through
+                if not through._meta.auto_created:
+                    getattr(instance, field.name).set(values)
+                    continue
+                source = field.m2m_field_name()
+                target = field.m2m_reverse_field_name()
+                rows = through_rows.setdefault((through, field.related_model), [])
+                for value in values:
+                    rows.append(through(**{'%s_id' % source: instance.pk, '%s_id' % target: value.pk}))
+        for (through, related_model), rows in through_rows.items():
+            through.objects.bulk_create(rows)
+            bump_model_generation(model)
+            bump_model_generation(related_model)
+        return instances
+
+
+@method_decorator(instrument('bulk_update'), name='dispatch')
+class ItemBulkUpdate(generics.GenericAPIView):
+    """Concrete view for partially updating a list of model instances in a single transaction.
+
+    Each item in the list must contain the `id` of the instance and the fields to change and can contain an `if_match`
+    etag. Every item is validated before anything is saved and each save only goes ahead if the instance still has the
+    version it had when it was loaded (and the `if_match` value if given). The result of each item is returned.
+    """
+
+    permission_classes = (permissions.DjangoModelPermissions,)
+
+    def get_serializer_class(self):
+        """Return the class to use for the serializer."""
+        return _get_write_serializer_class(self.kwargs)
+
+    def get_queryset(self):
+        """Get the list of items for this view."""
+        return _get_endpoint(self.kwargs).model.objects.all()
+
+    def patch(self, request, *args, **kwargs):
+        """Update the items."""
+        endpoint = _get_endpoint(self.kwargs)
+        items = _get_bulk_items(request)
+        instances = self.get_instances(endpoint, items)
+        modified = {
+            'last_modified_time': datetime.datetime.now(),
+            'last_modified_by': _get_user_identifier(request.user),
+        }
+        serializer_class = self.get_serializer_class()
+
+        results = []
+        updates = []
+        seen = set()
+        for item in items:
+            if not isinstance(item, dict) or 'id' not in item:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'message': 'An id is required'})
+                continue
+            instance = instances.get(str(item['id']))
+            if instance is None:
+                results.append({'id': item['id'], 'status': status.HTTP_404_NOT_FOUND, 'message': 'Item not found'})
+                continue
+            if instance.pk in seen:
+                results.append({'id': item['id'], 'status': status.HTTP_400_BAD_REQUEST, 'message': 'Duplicate id'})
+                continue
+            seen.add(instance.pk)
+            etag = '%s' % getattr(instance, 'version_number', '')
+            if 'if_match' in item and not _etag_in_header(item['if_match'], etag):
+                results.append(
+                    {
+                        'id': item['id'],
+                        'status': status.HTTP_412_PRECONDITION_FAILED,
+                        'message': 'The item has been changed since it was retrieved',
+                    }
+                )
+                continue
+            data = {key: value for key, value in item.items() if key not in ['id', 'if_match']}
+            # each item is validated with only its own fields so an invalid item gets its own errors before any saves
+            serializer = serializer_class(instance, data=data, fields=_get_bulk_fields(endpoint, [data]), partial=True)
+            if not serializer.is_valid():
+                results.append({'id': item['id'], 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+                continue
+            results.append(None)
+            updates.append((len(results) - 1, instance, serializer))
+
+        saved = []
+        with transaction.atomic(using=router.db_for_write(endpoint.model)):
+            for index, instance, serializer in updates:
+                if isinstance(instance, BaseModel):
+                    instance.set_expected_version(instance.version_number)
+                try:
+                    serializer.save(**modified)
+                except VersionConflict:
+                    results[index] = {
+                        'id': instance.pk,
+                        'status': status.HTTP_412_PRECONDITION_FAILED,
+                        'message': 'The item has been changed since it was retrieved',
+                    }
+                    continue
+                saved.append((index, instance))
+
+        saved_results = _get_bulk_results(endpoint, [instance for index, instance in saved], status.HTTP_200_OK)
+        for (index, instance), result in zip(saved, saved_results):
+            results[index] = result
+        if len(saved) == len(results):
+            return Response(results)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    def get_instances(self, endpoint, items):
+        """Return the instances referred to by the items in a dictionary keyed by the string value of the id."""
+        pks = []
+        for item in items:
+            if isinstance(item, dict) and 'id' in item:
+                try:
+                    pks.append(endpoint.model._meta.pk.to_python(item['id']))
+                except DjangoValidationError:
+                    pass
+        queryset = self.get_queryset()
+        if endpoint.related_keys:
+            queryset = queryset.select_related(*endpoint.related_keys)
+        return {str(instance.pk): instance for instance in queryset.filter(pk__in=pks)}
+
+
+@method_decorator(instrument('delete'), name='dispatch')
+class ItemDelete(RequestInstanceMixin, generics.DestroyAPIView):
     """Concrete view for deleting a model instance."""
 
     permission_classes = (permissions.DjangoModelPermissions,)
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        return target.objects.all()
+        return _get_endpoint(self.kwargs).model.objects.all()
 
     def delete(self, request, *args, **kwargs):
         """Delete the item."""
@@ -453,7 +1251,8 @@ class ItemDelete(generics.DestroyAPIView):
             return Response({'responseText': 'ProtectedError'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class M2MItemDelete(generics.UpdateAPIView):
+@method_decorator(instrument('m2m_delete'), name='dispatch')
+class M2MItemDelete(RequestInstanceMixin, generics.UpdateAPIView):
     """Concrete view for delete M2M relation and updating a model instance."""
 
     # this is called as a PATCH as although it does delete the link, it also updates the target object
@@ -461,21 +1260,17 @@ class M2MItemDelete(generics.UpdateAPIView):
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        target = apps.get_model(self.kwargs['app'], self.kwargs['model'])
-        return target.objects.all()
+        return _get_endpoint(self.kwargs).model.objects.all()
 
     def update(self, request, *args, **kwargs):
         """Update the target object and delete the linked item."""
         instance = self.get_object()
-        author = apps.get_model(self.kwargs['app'], self.kwargs['itemmodel']).objects.get(pk=self.kwargs['itempk'])
+        item_endpoint = get_endpoint(self.kwargs['app'], self.kwargs['itemmodel'])
+        if item_endpoint is None:
+            raise Http404('Model does not exist')
+        author = item_endpoint.model.objects.get(pk=self.kwargs['itempk'])
         getattr(instance, self.kwargs['fieldname']).remove(author)
         instance.last_modified_time = datetime.datetime.now()
-        if django_settings.USER_IDENTIFIER_FIELD and (
-            hasattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-            and getattr(request.user, django_settings.USER_IDENTIFIER_FIELD) != ''
-        ):
-            instance.last_modified_by = getattr(request.user, django_settings.USER_IDENTIFIER_FIELD)
-        else:
-            instance.last_modified_by = request.user.username
+        instance.last_modified_by = _get_user_identifier(request.user)
         instance.save()
         return Response(status=status.HTTP_204_NO_CONTENT)